@@ -300,6 +300,33 @@ def bboxCheck(feature1, feature2):
     # return true if BoundBox1 encloses BoundBox2
     return feature1.BoundBox.isInside(feature2.BoundBox)
 
+class LinkedFeature:
+    # One element of an App::Link array, as a feature with Shape and Label
+    def __init__(self, shape, label):
+        self.Shape = shape
+        self.Label = label
+
+def expandLinks(grp_list):
+    # Replace App::Link arrays of block references by one LinkedFeature per
+    # placed shape of the linked block, other features are kept
+    features = []
+    for feature in grp_list:
+        if feature.TypeId != 'App::Link' or feature.LinkedObject is None:
+            features.append(feature)
+            continue
+        source = feature.LinkedObject
+        placements = list(feature.PlacementList) or [feature.LinkPlacement]
+        scales = list(feature.ScaleList) or [App.Vector(1, 1, 1)] * len(placements)
+        for i, (pl, sc) in enumerate(zip(placements, scales)):
+            s = App.Matrix()
+            s.scale(sc)
+            m = pl.toMatrix().multiply(s)
+            for j, shape in enumerate(source.Shape.childShapes() or [source.Shape]):
+                linked = shape.copy()
+                linked.transformShape(m, False, True)
+                features.append(LinkedFeature(linked, "{}_{}_{}".format(feature.Label, i, j)))
+    return features
+
 def featureToClosedWire(grp_list, is_layer_silk):
     wire_list=[]
     label_list=[]
@@ -516,7 +543,7 @@ class Layer():
     def __init__(self, label, is_layer_silk=False):
         #self.name = name
         self.label = label
-        self.wire_list, self.label_list = featureToClosedWire(self.getLayer().Group, is_layer_silk)
+        self.wire_list, self.label_list = featureToClosedWire(expandLinks(self.getLayer().Group), is_layer_silk)
         self.face_list = []
         self.depth = self.getDepth()
 
@@ -554,7 +581,7 @@ class specialLayer(Layer):
     def getLayer(self):
         return super().getLayer()
     def getWire(self):
-        return [feature.Shape for feature in self.getLayer().Group]
+        return [feature.Shape for feature in expandLinks(self.getLayer().Group)]
 
 def checkForProblem(layer_selected_list, quad_tree, dr):
     result = []
@@ -6,9 +6,9 @@ import pcaplib
 import logging
 import LayerAnalysis
 
-import ezdxf
 from FreeCAD import Console as FCC
 import ezlib
+import ezread
 
 __dir__ = os.path.dirname(__file__)
 
@@ -45,6 +45,9 @@ class Setting:
 
         # dxf doc
         self.dxfdoc = None
+        self.dxfPath = ""
+        # layers already drawn from dxfPath, reused by the next play
+        self.session = None
 
         # Remember user's last settings
         #self.widget.prefPCAPOutputFolder.setText(p.GetString("prefPCAPOutputFolder", ""))
@@ -168,16 +171,21 @@ class Setting:
     def on_playButton_clicked(self):
         self.widget.hide()
         if self.widget.tabWidget.currentIndex() == 0:
-            ezlib.ezprocessdxf(self.dxfdoc, self.get_all_selected_layers('router'), FreeCAD.ActiveDocument)
+            sel_layer = self.get_all_selected_layers('router')
+            ezlib.ezprocessdxf(None, sel_layer, FreeCAD.ActiveDocument, self.dxfPath, self.session)
             #LayerAnalysis.run_router()
         elif self.widget.tabWidget.currentIndex() == 1:
-            ezlib.ezprocessdxf(self.dxfdoc, self.get_all_selected_layers('unloader'), FreeCAD.ActiveDocument)
+            sel_layer = self.get_all_selected_layers('unloader')
+            ezlib.ezprocessdxf(None, sel_layer, FreeCAD.ActiveDocument, self.dxfPath, self.session)
             #LayerAnalysis.run_unloader()
         elif self.widget.tabWidget.currentIndex() == 2:
-            ezlib.ezprocessdxf(self.dxfdoc, self.get_all_selected_layers('wave'), FreeCAD.ActiveDocument)
+            sel_layer = self.get_all_selected_layers('wave')
+            # the wave analysis reads one feature per shape
+            ezlib.ezprocessdxf(None, sel_layer, FreeCAD.ActiveDocument, self.dxfPath, self.session, batchObjects=False)
             LayerAnalysis.run_wave()
         elif self.widget.tabWidget.currentIndex() == 3:
-            ezlib.ezprocessdxf(self.dxfdoc, self.get_all_selected_layers('press'), FreeCAD.ActiveDocument)
+            sel_layer = self.get_all_selected_layers('press')
+            ezlib.ezprocessdxf(None, sel_layer, FreeCAD.ActiveDocument, self.dxfPath, self.session)
             #LayerAnalysis.run_press()
 
     @QtCore.Slot()
@@ -397,5 +405,8 @@ class Setting:
 
     def set_dxfdoc(self, file_path):
         self.outputFolder = os.path.dirname(file_path)
-        self.dxfdoc = ezdxf.readfile(file_path)
+        self.dxfPath = file_path
+        # Only the tables are loaded here, the geometry is read per run
+        self.dxfdoc = ezread.ezreadLayers(file_path, [])
+        self.session = ezlib.ImportSession()
         FCC.PrintMessage("successfully loaded " + file_path + "\n")
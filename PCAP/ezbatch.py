@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import fnmatch
+import argparse
+from time import time
+from collections import deque
+from multiprocessing.connection import wait
+import ezread
+from ezgeom import ezpoolContext
+from ezjoindxf import ezjoinDxf, ezjoinedPath
+
+# Join a directory of DXF files on a bounded set of worker processes.
+# Every file runs ezjoinDxf in a process of its own, so a file that runs
+# past the timeout is terminated without taking a pool down with it.
+# manifest.json in the output directory lists each file with its status
+# (ok, error, timeout or crashed), wall time, stage times and output path.
+#   python PCAP/ezbatch.py DIR [-o OUTDIR] [-l LAYER ...] [--workers N]
+#       [--timeout SECS] [--tol 1e-3] [--engine greedy|graph] [--snap] [--dedupe]
+#       [--merge] [--simplify 1e-3] [--links]
+
+MANIFEST = "manifest.json"
+
+def ezbatchFiles(in_dir, pattern="*.dxf"):
+    # DXF files of in_dir, joined outputs of an earlier run left out
+    names = [name for name in os.listdir(in_dir)
+             if fnmatch.fnmatch(name.lower(), pattern.lower()) and not name.lower().endswith(".joined.dxf")]
+    return [os.path.join(in_dir, name) for name in sorted(names)]
+
+def _joinFile(conn, file_path, layers, out_path, options):
+    # Worker process: join one file and send back its manifest entry
+    try:
+        layers = layers or ezread.ezreadLayerNames(file_path)
+        profile = ezjoinDxf(file_path, layers, out_path, log=lambda text: None, **options)
+        conn.send({"status": "ok", "layers": layers, "stages": profile.totals()})
+    except Exception as err:
+        conn.send({"status": "error", "error": "{}: {}".format(type(err).__name__, err)})
+    conn.close()
+
+class BatchJoin:
+    def __init__(self, out_dir, layers=None, workers=0, timeout=300.0, **options):
+        # options go to ezjoinDxf: tol, engine, snap, dedupe, merge, simplify, links
+        self.m_outDir = out_dir
+        self.m_layers = layers
+        self.m_workers = workers or os.cpu_count() or 1
+        self.m_timeout = timeout
+        self.m_options = options
+        os.makedirs(self.m_outDir, exist_ok=True)
+
+    def outputPath(self, file_path):
+        return os.path.join(self.m_outDir, os.path.basename(ezjoinedPath(file_path)))
+
+    def run(self, files, log=print):
+        # Returns the manifest entries in the order of files
+        ctx = ezpoolContext()
+        pending = deque(enumerate(files))
+        running = {}   # pipe -> (index, file_path, process, start)
+        entries = [None] * len(files)
+        while pending or running:
+            while pending and len(running) < self.m_workers:
+                i, file_path = pending.popleft()
+                reader, writer = ctx.Pipe(duplex=False)
+                proc = ctx.Process(target=_joinFile, args=(writer, file_path, self.m_layers, self.outputPath(file_path), self.m_options))
+                proc.start()
+                writer.close()
+                running[reader] = (i, file_path, proc, time())
+
+            now = time()
+            deadline = min(start + self.m_timeout for i, f, p, start in running.values()) if self.m_timeout else None
+            ready = wait(list(running), None if deadline is None else max(0.0, deadline - now))
+            now = time()
+            for reader in list(running):
+                i, file_path, proc, start = running[reader]
+                if reader in ready:
+                    try:
+                        entry = reader.recv()
+                    except EOFError:
+                        proc.join()
+                        entry = {"status": "crashed", "error": "exit code {}".format(proc.exitcode)}
+                elif self.m_timeout and now - start >= self.m_timeout:
+                    proc.terminate()
+                    entry = {"status": "timeout", "error": "no result after {} secs".format(self.m_timeout)}
+                else:
+                    continue
+                proc.join()
+                reader.close()
+                del running[reader]
+                entry.update({"file": file_path, "secs": now - start})
+                entry["output"] = self.outputPath(file_path) if entry["status"] == "ok" else None
+                entries[i] = entry
+                log("{:8s} {:8.2f} secs {}".format(entry["status"], entry["secs"], file_path))
+        return entries
+
+    def manifest(self, entries, secs):
+        status = {}
+        for entry in entries:
+            status[entry["status"]] = status.get(entry["status"], 0) + 1
+        return {
+            "outDir": self.m_outDir,
+            "workers": self.m_workers,
+            "timeout": self.m_timeout,
+            "layers": self.m_layers,
+            "options": self.m_options,
+            "secs": secs,
+            "status": status,
+            "files": entries,
+        }
+
+    def save(self, manifest):
+        path = os.path.join(self.m_outDir, MANIFEST)
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, ensure_ascii=False)
+        os.replace(tmp, path)
+        return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Join every DXF file of a directory without FreeCAD")
+    parser.add_argument("dir")
+    parser.add_argument("-o", "--output", help="output directory, the input directory by default")
+    parser.add_argument("-l", "--layer", action="append", dest="layers", help="layer to join, repeat for more, all layers when left out")
+    parser.add_argument("--pattern", default="*.dxf")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, the core count by default")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds per file, 0 for none")
+    parser.add_argument("--tol", type=float, default=0.0, help="endpoint tolerance, 0 for ezdxf isclose")
+    parser.add_argument("--engine", choices=["greedy", "graph"], default="greedy")
+    parser.add_argument("--snap", action="store_true", help="snap endpoints within --tol before joining")
+    parser.add_argument("--dedupe", action="store_true", help="drop repeated LINE, ARC and LWPOLYLINE pieces before joining")
+    parser.add_argument("--merge", action="store_true", help="merge collinear LINE pieces that overlap or touch before joining")
+    parser.add_argument("--simplify", type=float, default=0.0, help="chord tolerance to drop straight polyline vertexes within, 0 for none")
+    parser.add_argument("--links", action="store_true", help="keep block references as INSERTs of the joined blocks")
+    args = parser.parse_args(argv)
+
+    files = ezbatchFiles(args.dir, args.pattern)
+    batch = BatchJoin(args.output or args.dir, args.layers, args.workers, args.timeout,
+                      tol=args.tol or None, engine=args.engine, snap=args.snap, dedupe=args.dedupe,
+                      merge=args.merge, simplify=args.simplify, links=args.links)
+    print("Joining {} files on {} workers".format(len(files), min(batch.m_workers, len(files))), flush=True)
+    start = time()
+    entries = batch.run(files, lambda text: print(text, flush=True))
+    manifest = batch.manifest(entries, time() - start)
+    print("{} in {:.2f} secs, manifest {}".format(
+        ", ".join("{} {}".format(n, s) for s, n in sorted(manifest["status"].items())), manifest["secs"], batch.save(manifest)))
+    return 0 if manifest["status"].get("ok", 0) == len(files) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+import math
+import numpy as np
+import ezdxf
+from ezdxf.math import Vec2, Z_AXIS, arc_angle_span_deg, arc_angle_span_rad
+from ezdxf.math.transformtools import OCSTransform, DEG, RADIANS
+from ezdxf.entities.copy import CopyNotSupported
+from ezgeom import LayerGeometry, ezpackEntity
+
+# Block definitions exploded once into a template in block coordinates.
+# The INSERTs of a layer are instanced by running their matrix44() over the
+# coordinate arrays of the template in one numpy step per block, with the
+# operations in the order ezdxf transforms the virtual entities of
+# e.virtual_entities(), so the raws come out the same. Only matrices that
+# keep the block in the XY plane with a uniform scale and no mirroring are
+# instanced; accepts() is False for the others and for blocks a template can
+# not stand in for, and the caller explodes those with virtual_entities().
+
+Z_EXTRUSION = (0.0, 0.0, 1.0)
+DROPPED, PIECE, FINISHED, CLASSIFY = -1, 0, 1, 2
+
+def ezclosedPolyline(points, format="xyseb"):
+    # Raw closed LWPOLYLINE as add_lwpolyline(points, format, close=True) makes it
+    polyline = ezdxf.entities.LWPolyline.new()
+    polyline.append_points(points, format=format)
+    polyline.close(True)
+    return ezpackEntity(polyline)
+
+def ezoblongPolyline(C1, C2, R):
+    # Raw closed outline of an OBLONG pad: the centre line C1 C2 widened by
+    # R to both sides with half circle ends
+    CC = (C1 - C2).normalize()
+    N = Vec2(-CC.y, CC.x)
+    ob1 = C1 + R*N
+    ob2 = C2 + R*N
+    ob3 = C2 - R*N
+    ob4 = C1 - R*N
+    points = [(ob1.x, ob1.y, 0.0, 0.0, 0.0), (ob2.x, ob2.y, 0.0, 0.0, 1.0),
+              (ob3.x, ob3.y, 0.0, 0.0, 0.0), (ob4.x, ob4.y, 0.0, 0.0, 1.0)]
+    return ('LWPOLYLINE', points, 0.0, True, 0.0)
+
+def _isclose(a, b, rel_tol=1e-9, abs_tol=1e-12):
+    # math.isclose on arrays, as Vec2.isclose compares each coordinate
+    diff = np.abs(b - a)
+    return (diff <= np.abs(rel_tol * b)) | (diff <= np.abs(rel_tol * a)) | (diff <= abs_tol)
+
+def _transform(m, x, y, z):
+    # Matrix44.transform of the points (x, y, z)
+    return (x * m[0] + y * m[4] + z * m[8] + m[12],
+            x * m[1] + y * m[5] + z * m[9] + m[13],
+            x * m[2] + y * m[6] + z * m[10] + m[14])
+
+def _length(m, x, y):
+    # Magnitude of Matrix44.transform_direction((x, y, 0))
+    dx = x * m[0] + y * m[4] + 0.0 * m[8]
+    dy = x * m[1] + y * m[5] + 0.0 * m[9]
+    dz = x * m[2] + y * m[6] + 0.0 * m[10]
+    return np.sqrt(dx * dx + dy * dy + dz * dz)
+
+def _width(m, w):
+    # OCSTransform.transform_width
+    w = np.abs(w)
+    return np.where(w > 1e-12, np.maximum(_length(m, w, 0.0), _length(m, 0.0, w)), 0.0)
+
+def _angle(m, cos, sin):
+    # OCSTransform.transform_angle of the angles with the given cos and sin
+    x = cos * m[0] + sin * m[4] + 0.0 * m[8]
+    y = cos * m[1] + sin * m[5] + 0.0 * m[9]
+    # math.atan2 as Vec3.angle, np.arctan2 may round the last bit otherwise
+    return np.array([math.atan2(b, a) for a, b in zip(x.ravel().tolist(), y.ravel().tolist())]).reshape(x.shape)
+
+class BlockTemplate:
+    def __init__(self, block_layout, oblong=False):
+        self.m_name = block_layout.name
+        self.m_oblong = oblong
+        self.m_simple = True
+        raws = []
+        route = []
+        solid = []
+        for be in block_layout:
+            dxftype = be.dxftype()
+            if dxftype == 'ATTDEF':
+                continue
+            if oblong and dxftype != 'LWPOLYLINE':
+                # the OBLONG code reads every entity as a polyline
+                self.m_simple = False
+            if dxftype in ('CIRCLE', 'ARC', 'LWPOLYLINE', 'SOLID'):
+                if tuple(be.dxf.extrusion) != Z_EXTRUSION:
+                    self.m_simple = False
+            if dxftype == 'CIRCLE':
+                raws.append(ezpackEntity(be))
+                route.append(FINISHED)
+            elif dxftype in ('LINE', 'ARC'):
+                raws.append(ezpackEntity(be))
+                route.append(PIECE)
+            elif dxftype == 'LWPOLYLINE':
+                if len(be) == 0:
+                    self.m_simple = False
+                raws.append(ezpackEntity(be))
+                route.append(CLASSIFY)
+            elif dxftype == 'SOLID':
+                # closed polyline of the SOLID vertices, z in the start width
+                # column the way ezclosedPolyline(be.vertices()) stores it
+                raws.append(ezclosedPolyline(be.vertices()))
+                route.append(FINISHED)
+                solid.append(len(raws) - 1)
+            elif dxftype != 'INSERT':
+                # virtual_entities() explodes entities it can not copy
+                try:
+                    be.copy()
+                except CopyNotSupported:
+                    self.m_simple = False
+
+        g = self.m_geom = LayerGeometry.fromRaws(raws)
+        self.m_route = np.array(route, dtype=np.int8)
+        kinds = LayerGeometry.KINDS
+        self.m_lines = np.flatnonzero(g.m_kind == kinds.index('LINE'))
+        self.m_circles = np.flatnonzero((g.m_kind == kinds.index('CIRCLE')) | (g.m_kind == kinds.index('ARC')))
+        self.m_polys = np.flatnonzero(g.m_kind == kinds.index('LWPOLYLINE'))
+        self.m_classify = np.flatnonzero(self.m_route == CLASSIFY)
+
+        # Per vertex z for the transform: the elevation of the polyline, the
+        # start width column for SOLIDs
+        counts = np.diff(g.m_voffsets)
+        self.m_solid = np.zeros(len(g), dtype=bool)
+        self.m_solid[solid] = True
+        self.m_plain = self.m_polys[~self.m_solid[self.m_polys]]
+        self.m_vsolid = np.repeat(self.m_solid, counts)
+        self.m_vz = np.where(self.m_vsolid, g.m_verts[:, 2], np.repeat(g.m_params[:, 2], counts))
+
+        # Arc angles as cos and sin, arcs of a full span keep their angles
+        arcs = np.flatnonzero(g.m_kind == kinds.index('ARC'))
+        turned, full, trig = [], [], []
+        for i in arcs.tolist():
+            s, e = g.m_params[i, 4], g.m_params[i, 5]
+            if math.isclose(arc_angle_span_deg(s, e), 360.0):
+                continue
+            span = arc_angle_span_rad(s * RADIANS, e * RADIANS)
+            full.append(math.isclose(span, math.tau))
+            if not full[-1] and not 1e-6 < span < math.tau - 1e-6:
+                # the span test of transform_ccw_arc_angles may swap the
+                # angles of near empty arcs
+                self.m_simple = False
+            turned.append(i)
+            trig.append((math.cos(s * RADIANS), math.sin(s * RADIANS), math.cos(e * RADIANS), math.sin(e * RADIANS)))
+        self.m_arcs = np.array(turned, dtype=np.int64)
+        self.m_full = np.array(full, dtype=bool)
+        self.m_trig = np.array(trig, dtype=np.float64).reshape(-1, 4)
+
+        if oblong:
+            # R from the first closed polyline, C1 C2 from the last open one
+            closed = [i for i in self.m_polys.tolist() if g.m_params[i, 1]]
+            opened = [i for i in self.m_polys.tolist() if not g.m_params[i, 1]]
+            if not closed or not opened or counts[closed[0]] < 2 or counts[opened[-1]] < 2:
+                self.m_simple = False
+            else:
+                self.m_oblongVerts = [g.m_voffsets[closed[0]], g.m_voffsets[closed[0]] + 1,
+                                      g.m_voffsets[opened[-1]], g.m_voffsets[opened[-1]] + 1]
+
+    @property
+    def rows(self):
+        # Rows of one instance
+        return 1 if self.m_oblong else len(self.m_geom)
+
+    def accepts(self, m):
+        # True when the INSERT with matrix m can be instanced
+        if not self.m_simple:
+            return False
+        ocs = OCSTransform(Z_AXIS, m)
+        return ocs.scale_uniform and tuple(ocs.new_extrusion) == Z_EXTRUSION
+
+    def _transformed(self, m):
+        # params (n, rows, 6) and verts (n, verts, 5) of the template
+        # transformed by m, a list of 16 columns of n matrix values
+        g = self.m_geom
+        n = len(m[0])
+        params = np.repeat(g.m_params[None], n, axis=0)
+        verts = np.repeat(g.m_verts[None], n, axis=0)
+
+        p = params[:, self.m_lines]
+        p[..., 0], p[..., 1], p[..., 2] = _transform(m, p[..., 0], p[..., 1], p[..., 2])
+        p[..., 3], p[..., 4], p[..., 5] = _transform(m, p[..., 3], p[..., 4], p[..., 5])
+        params[:, self.m_lines] = p
+
+        p = params[:, self.m_circles]
+        p[..., 0], p[..., 1], p[..., 2] = _transform(m, p[..., 0], p[..., 1], p[..., 2])
+        p[..., 3] = _length(m, p[..., 3], 0.0)
+        params[:, self.m_circles] = p
+        if len(self.m_arcs):
+            start = _angle(m, self.m_trig[:, 0], self.m_trig[:, 1])
+            end = np.where(self.m_full, start + math.tau, _angle(m, self.m_trig[:, 2], self.m_trig[:, 3]))
+            params[:, self.m_arcs, 4] = start * DEG
+            params[:, self.m_arcs, 5] = end * DEG
+
+        if g.m_verts.size:
+            x, y, z = _transform(m, g.m_verts[:, 0], g.m_verts[:, 1], self.m_vz)
+            solid = self.m_vsolid
+            verts[..., 2] = np.where(solid, z, _width(m, g.m_verts[:, 2]))
+            verts[..., 3] = np.where(solid, g.m_verts[:, 3], _width(m, g.m_verts[:, 3]))
+            verts[..., 0], verts[..., 1] = x, y
+            # the elevation is the z of the first vertex
+            params[:, self.m_plain, 2] = z[:, g.m_voffsets[self.m_plain]]
+            params[:, self.m_plain, 0] = _width(m, g.m_params[self.m_plain, 0])
+        return params, verts
+
+    def instances(self, matrices):
+        # (geometry, route) of one instance per matrix, rows instance by
+        # instance; route is PIECE, FINISHED or DROPPED per row
+        m = np.asarray(matrices, dtype=np.float64).reshape(-1, 16)
+        n = len(m)
+        params, verts = self._transformed([m[:, j, None] for j in range(16)])
+
+        if self.m_oblong:
+            raws = []
+            for v in verts[:, self.m_oblongVerts, :2].tolist():
+                V1, V2, C1, C2 = (Vec2(p) for p in v)
+                raws.append(ezoblongPolyline(C1, C2, V1.distance(V2)))
+            return LayerGeometry.fromRaws(raws), np.full(n, FINISHED, dtype=np.int8)
+
+        g = self.m_geom
+        rows, nverts = len(g), len(g.m_verts)
+        voffsets = (g.m_voffsets[None, :-1] + nverts * np.arange(n)[:, None]).ravel()
+        geom = LayerGeometry(np.tile(g.m_kind, n), params.reshape(-1, 6), np.tile(g.m_extrusion, (n, 1)),
+                             np.append(voffsets, n * nverts), verts.reshape(-1, 5), np.zeros(n * rows, dtype=np.int64))
+        route = np.tile(self.m_route, n)
+
+        classify = (self.m_classify[None] + rows * np.arange(n)[:, None]).ravel()
+        if len(classify):
+            # closed or ending on its start point: a closed shape, unless
+            # every vertex sits on the first one
+            verts = geom.m_verts
+            first = geom.m_voffsets[classify]
+            last = geom.m_voffsets[classify + 1] - 1
+            near = (geom.m_params[classify, 1] != 0) \
+                | (_isclose(verts[first, 0], verts[last, 0]) & _isclose(verts[first, 1], verts[last, 1]))
+            counts = last - first + 1
+            offsets = np.append(0, np.cumsum(counts)[:-1])
+            vrows = np.repeat(first - offsets, counts) + np.arange(counts.sum())
+            start = np.repeat(first, counts)
+            same = (verts[vrows, 0] == verts[start, 0]) & (verts[vrows, 1] == verts[start, 1])
+            point = np.logical_and.reduceat(same, offsets)
+            route[classify] = np.where(near, np.where(point, DROPPED, FINISHED), PIECE)
+            geom.m_params[classify[near], 1] = 1.0
+        return geom, route
+
+def ezassembleGeometry(entries, built, route, handles=None):
+    # LayerGeometry of entries, raws and (template, k) markers of instanced
+    # INSERTs, in the order of entries. built is {template: instances()},
+    # a marker stands for the rows of instance k with the given route.
+    # Markers of templates missing from built (linked INSERTs) are left out.
+    raws, raw_handles, raw_pos = [], [], []
+    positions = {}
+    for p, entry in enumerate(entries):
+        if isinstance(entry[0], BlockTemplate):
+            if entry[0] in built:
+                positions.setdefault(entry[0], []).append(p)
+        else:
+            raws.append(entry)
+            raw_pos.append(p)
+            if handles is not None:
+                raw_handles.append(handles[p])
+    geom = LayerGeometry.fromRaws(raws, raw_handles if handles is not None else None)
+    if not positions:
+        return geom
+    parts = [geom]
+    keys = [np.array(raw_pos, dtype=np.int64)]
+    for template, pos in positions.items():
+        instanced, routes = built[template]
+        rows = np.flatnonzero(routes == route)
+        parts.append(instanced.take(rows))
+        keys.append(np.array(pos, dtype=np.int64)[rows // template.rows])
+    # rows of one instance share a key and keep their order in a stable sort
+    return LayerGeometry.concat(parts).take(np.argsort(np.concatenate(keys), kind='stable'))
+
+class BlockLinks:
+    # The INSERTs of a layer kept as block references: per block name the
+    # joined block geometry in block coordinates and the matrix44() of
+    # every INSERT, one row of 16 values each
+    def __init__(self):
+        self.m_blocks = {}
+
+    def add(self, name, geom, matrices):
+        self.m_blocks[name] = (geom, np.asarray(matrices, dtype=np.float64).reshape(-1, 16))
+
+    def __len__(self):
+        # linked INSERTs
+        return sum(len(matrices) for geom, matrices in self.m_blocks.values())
+
+    def items(self):
+        return self.m_blocks.items()
+
+    def placements(self, name):
+        # (x, y, z, rotation in degrees, scale) per INSERT of block name
+        m = self.m_blocks[name][1]
+        rotation = np.degrees(np.arctan2(m[:, 1], m[:, 0]))
+        scale = np.hypot(m[:, 0], m[:, 1])
+        return list(zip(m[:, 12].tolist(), m[:, 13].tolist(), m[:, 14].tolist(), rotation.tolist(), scale.tolist()))
+
+    def arrays(self):
+        # Arrays to store next to the layer's LayerGeometry in one .npz
+        data = {}
+        for i, (name, (geom, matrices)) in enumerate(self.m_blocks.items()):
+            data["block{}_name".format(i)] = np.array(name)
+            data["block{}_matrices".format(i)] = matrices
+            for key, a in geom.arrays().items():
+                data["block{}_{}".format(i, key)] = a
+        return data
+
+    @classmethod
+    def fromArrays(cls, data):
+        links = cls()
+        i = 0
+        while "block{}_name".format(i) in data:
+            prefix = "block{}_".format(i)
+            geom = LayerGeometry.fromArrays({name: data[prefix + name] for name in LayerGeometry.ARRAYS})
+            links.add(str(data[prefix + "name"]), geom, data[prefix + "matrices"])
+            i += 1
+        return links
+
+    def addTo(self, doc, msp, dxfattribs=None):
+        # A block per name in doc and an INSERT per placement in msp
+        for name, (geom, matrices) in self.m_blocks.items():
+            if doc.blocks.get(name) is None:
+                geom.addTo(doc.blocks.new(name))
+            for x, y, z, rotation, scale in self.placements(name):
+                attribs = dict(dxfattribs or {}, rotation=rotation, xscale=scale, yscale=scale, zscale=scale)
+                msp.add_blockref(name, (x, y, z), dxfattribs=attribs)
@@ -0,0 +1,113 @@
+import os
+import io
+import hashlib
+import zipfile
+import numpy as np
+from ezgeom import LayerGeometry
+from ezblocks import BlockLinks
+
+# On-disk cache of processed layers. The key is the DXF content hash,
+# the layer name and the join settings; the value is everything the layer
+# contributes to tmpdoc (joined polylines, closed shapes, circles), stored
+# as the arrays of its LayerGeometry in one .npz file per layer, with the
+# arrays of its BlockLinks when blocks are linked.
+# The files' mtime is the LRU clock: a hit touches the file and a put
+# evicts the oldest files until the cache fits in maxBytes.
+
+CACHE_VERSION = 3
+
+class LayerCache:
+    def __init__(self, cacheDir, maxBytes=512 * 1024 * 1024):
+        self.m_dir = cacheDir
+        self.m_maxBytes = maxBytes
+        self.m_hits = 0
+        self.m_misses = 0
+        self.m_evictions = 0
+        self.m_fileHashes = {}
+        os.makedirs(self.m_dir, exist_ok=True)
+
+    def fileHash(self, file_path):
+        # sha256 of the file content, remembered per (path, size, mtime)
+        st = os.stat(file_path)
+        stamp = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+        if stamp not in self.m_fileHashes:
+            h = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            self.m_fileHashes[stamp] = h.hexdigest()
+        return self.m_fileHashes[stamp]
+
+    def _path(self, fileHash, layer, joinKey):
+        key = "{}\0{}\0{}\0{}".format(CACHE_VERSION, fileHash, layer, repr(joinKey))
+        return os.path.join(self.m_dir, hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest() + ".npz")
+
+    def get(self, fileHash, layer, joinKey=()):
+        # Returns (layer color, LayerGeometry, BlockLinks or None) or None.
+        # joinKey is a tuple of the settings the join result depends on.
+        path = self._path(fileHash, layer, joinKey)
+        try:
+            with np.load(path) as data:
+                color = int(data["color"])
+                geom = LayerGeometry.fromArrays(data)
+                links = BlockLinks.fromArrays(data) if "links" in data else None
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            self.m_misses += 1
+            return None
+        os.utime(path)
+        self.m_hits += 1
+        return color, geom, links
+
+    def put(self, fileHash, layer, joinKey, color, geom, links=None):
+        path = self._path(fileHash, layer, joinKey)
+        buf = io.BytesIO()
+        arrays = dict(geom.arrays())
+        if links is not None:
+            arrays["links"] = np.int32(len(links))
+            arrays.update(links.arrays())
+        np.savez_compressed(buf, color=np.int32(color), **arrays)
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(buf.getvalue())
+        os.replace(tmp, path)
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.m_dir):
+            if name.endswith(".npz"):
+                st = os.stat(os.path.join(self.m_dir, name))
+                entries.append((st.st_mtime_ns, st.st_size, name))
+        return entries
+
+    def evict(self):
+        # Drop least recently used layers until the cache fits
+        entries = sorted(self._entries())
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in entries:
+            if total <= self.m_maxBytes:
+                break
+            os.remove(os.path.join(self.m_dir, name))
+            total -= size
+            self.m_evictions += 1
+
+    def clear(self):
+        for mtime, size, name in self._entries():
+            os.remove(os.path.join(self.m_dir, name))
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "dir": self.m_dir,
+            "entries": len(entries),
+            "bytes": sum(size for mtime, size, name in entries),
+            "maxBytes": self.m_maxBytes,
+            "hits": self.m_hits,
+            "misses": self.m_misses,
+            "evictions": self.m_evictions,
+        }
+
+    def statsText(self):
+        s = self.stats()
+        return "Layer cache: {} hits, {} misses, {} evictions, {} entries, {:.1f} / {:.0f} MB".format(
+            s["hits"], s["misses"], s["evictions"], s["entries"], s["bytes"] / 2**20, s["maxBytes"] / 2**20)
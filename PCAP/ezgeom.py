@@ -0,0 +1,1451 @@
+import os
+import sys
+import math
+import multiprocessing
+import numpy as np
+import ezdxf
+from ezdxf.math import Vec2
+from ezdxf.math import BoundingBox2d, OCS
+from ezdxf.math import arc_angle_span_deg
+from time import time
+from enum import Enum
+from array import array
+from types import SimpleNamespace
+
+class BVHAccel:
+    class splitMethod(Enum):
+        NAIVE = 0
+        SAH = 1
+
+    nBuckets = 12
+
+    def __init__(self, ents, splitMethod = splitMethod.NAIVE):
+        self.m_ents = ents
+        #self.m_maxPrimsInNode = maxPrimsInNode
+        self.m_splitMethod = splitMethod
+        # Linearized nodes in depth-first order: the first child of node i is
+        # node i+1, m_offsets[i] holds the second child, or -1-index of the
+        # entity for leaf nodes. m_bounds holds xmin, ymin, xmax, ymax per node.
+        self.m_bounds = array('d')
+        self.m_offsets = array('i')
+        start = time()
+        if len(self.m_ents) == 0:
+            self.m_buildTime = 0.0
+            return None
+
+        # Bounds and centroids of every entity, computed once
+        self.m_primBounds = np.array([ent.get_extents() for ent in self.m_ents], dtype=np.float64).reshape(-1, 4)
+        self.m_centroids = 0.5 * (self.m_primBounds[:, :2] + self.m_primBounds[:, 2:])
+
+        if self.m_splitMethod == BVHAccel.splitMethod.NAIVE:
+            nodeBounds, offsets = self._buildMedian()
+        else:
+            nodeBounds, offsets = self._build()
+        self.m_bounds = array('d', nodeBounds.tobytes())
+        self.m_offsets = array('i', offsets.tobytes())
+        self.m_buildTime = time() - start
+
+    def findNextEntity(self, entity_list):
+        # For Next Entity, consider entity_list[-1]
+        myEnt = entity_list[-1]
+        # check myEnt reverse: st, end
+        if myEnt.reverse == False:
+            st,end = 0,-1
+        else:
+            st,end = -1,0
+        # Try myEnt end_point, prefer the child holding myEnt start_point
+        for ent in self._traverse(myEnt.Vertexes[end], myEnt.Vertexes[st]):
+            if matchNext(ent, myEnt):
+                return ent
+        return None
+
+    def findPreviousEntity(self, reversed_polys):
+        # For Previous Entity
+        myEnt = reversed_polys[-1]
+        # check myEnt reverse: st, end
+        if myEnt.reverse == False:
+            st,end = 0,-1
+        else:
+            st,end = -1,0
+        # Try myEnt start_point, prefer the child holding myEnt end_point
+        for ent in self._traverse(myEnt.Vertexes[st], myEnt.Vertexes[end]):
+            if matchPrevious(ent, myEnt):
+                return ent
+        return None
+
+    def _traverse(self, pt, hint):
+        # Iterative traversal of the nodes containing pt, yields leaf entities.
+        # When both children contain pt, the one containing hint goes first.
+        if len(self.m_offsets) == 0:
+            return
+        bounds = self.m_bounds
+        offsets = self.m_offsets
+        x, y = pt.x, pt.y
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            if offsets[i] < 0:
+                yield self.m_ents[-1 - offsets[i]]
+                continue
+
+            left, right = i + 1, offsets[i]
+            l, r = 4 * left, 4 * right
+            point_in_left = bounds[l] <= x <= bounds[l+2] and bounds[l+1] <= y <= bounds[l+3]
+            point_in_right = bounds[r] <= x <= bounds[r+2] and bounds[r+1] <= y <= bounds[r+3]
+            if point_in_left and point_in_right:
+                if bounds[l] <= hint.x <= bounds[l+2] and bounds[l+1] <= hint.y <= bounds[l+3]:
+                    stack.append(right)
+                    stack.append(left)
+                else:
+                    stack.append(left)
+                    stack.append(right)
+            elif point_in_left:
+                stack.append(left)
+            elif point_in_right:
+                stack.append(right)
+
+    def _build(self):
+        # Depth-first build over index arrays, a full binary tree with one
+        # entity per leaf has 2n-1 nodes
+        n = len(self.m_ents)
+        offsets = [0] * (2*n - 1)
+        nNodes = 0
+        # (entity indexes, node waiting for this one as its second child)
+        stack = [(np.arange(n), -1)]
+        while stack:
+            idx, parent = stack.pop()
+            offset = nNodes
+            nNodes += 1
+            if parent >= 0:
+                offsets[parent] = offset
+
+            if len(idx) == 1:
+                offsets[offset] = -1 - int(idx[0])
+                continue
+
+            leftidx, rightidx = self._split(idx)
+            stack.append((rightidx, offset))
+            stack.append((leftidx, -1))
+
+        # Children always come after their parent, so a reverse sweep
+        # sees both child bounds before the parent
+        primBounds = self.m_primBounds.tolist()
+        nodeBounds = [None] * (2*n - 1)
+        for i in range(2*n - 2, -1, -1):
+            if offsets[i] < 0:
+                nodeBounds[i] = primBounds[-1 - offsets[i]]
+            else:
+                l = nodeBounds[i + 1]
+                r = nodeBounds[offsets[i]]
+                nodeBounds[i] = [min(l[0], r[0]), min(l[1], r[1]), max(l[2], r[2]), max(l[3], r[3])]
+        return np.array(nodeBounds, dtype=np.float64), np.array(offsets, dtype=np.int32)
+
+    def _buildMedian(self):
+        # The naive tree, median splits built a level at a time. order is
+        # the entity order of the recursive build, every node holds a
+        # contiguous range of it: each level sorts all ranges in one stable
+        # lexsort and halves them. A child keeps its parent's sorted order,
+        # which breaks the ties of its own split and orders the leaves of
+        # two entities, so a selection in place of the sort would change the
+        # tree and with it the join at branch vertexes.
+        n = len(self.m_ents)
+        c = self.m_centroids
+        order = np.arange(n)
+        node, start, size = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), np.full(1, n, dtype=np.int64)
+        levels = []
+        while len(node):
+            levels.append((node, start, size))
+            inner = size > 1
+            node, start, size = node[inner], start[inner], size[inner]
+            if not len(node):
+                break
+            # Sort the ranges of 3 or more entities along their wider centroid extent
+            seg = np.repeat(np.arange(len(node)), size)
+            rows = np.repeat(start - np.cumsum(size) + size, size) + np.arange(int(size.sum()))
+            cs = c[order[rows]]
+            cmin = np.minimum.reduceat(cs, np.cumsum(size) - size)
+            cmax = np.maximum.reduceat(cs, np.cumsum(size) - size)
+            d = cmax - cmin
+            dim = np.where(d[:, 0] > d[:, 1], 0, 1)
+            value = np.where(size[seg] > 2, cs[np.arange(len(rows)), dim[seg]], 0.0)
+            order[rows] = order[rows][np.lexsort((value, seg))]
+            left = (size + 1) // 2
+            node = np.concatenate([node + 1, node + 2 * left])
+            start = np.concatenate([start, start + left])
+            size = np.concatenate([left, size - left])
+            sort = np.argsort(start, kind='stable')
+            node, start, size = node[sort], start[sort], size[sort]
+
+        offsets = np.zeros(2*n - 1, dtype=np.int32)
+        nodeBounds = np.zeros((2*n - 1, 4), dtype=np.float64)
+        pb = np.vstack([self.m_primBounds[order], np.zeros((1, 4))])
+        for node, start, size in levels:
+            leaf = size == 1
+            offsets[node[leaf]] = -1 - order[start[leaf]]
+            offsets[node[~leaf]] = node[~leaf] + 2 * ((size[~leaf] + 1) // 2)
+            ends = np.stack([start, start + size], axis=1).ravel()
+            nodeBounds[node, :2] = np.minimum.reduceat(pb[:, :2], ends)[0::2]
+            nodeBounds[node, 2:] = np.maximum.reduceat(pb[:, 2:], ends)[0::2]
+        return nodeBounds, offsets
+
+    def _split(self, idx):
+        if len(idx) == 2:
+            return idx[:1], idx[1:]
+
+        c = self.m_centroids[idx]
+        cmin = c.min(axis=0)
+        cmax = c.max(axis=0)
+        d = cmax - cmin
+        dim = 0 if d[0] > d[1] else 1
+
+        # Small nodes split at the median, bucketing them costs more than it saves
+        if self.m_splitMethod == BVHAccel.splitMethod.SAH and len(idx) > 4 * BVHAccel.nBuckets and d[dim] > 0:
+            mask = self._sahSplit(idx, c[:, dim], cmin[dim], d[dim])
+            if mask is not None:
+                return idx[mask], idx[~mask]
+
+        # Median along dim, selected in O(n). Only SAH trees are built here,
+        # the naive tree is _buildMedian's
+        median = int((len(idx)+1)/2)
+        part = np.argpartition(c[:, dim], median - 1)
+        return idx[part[:median]], idx[part[median:]]
+
+    def _sahSplit(self, idx, c, cmin, extent):
+        # Bucketed surface area heuristic, the 2D "surface" is the perimeter.
+        # Returns the mask of the left side or None to fall back to the median.
+        nBuckets = BVHAccel.nBuckets
+        b = np.minimum((nBuckets * (c - cmin) / extent).astype(np.intp), nBuckets - 1)
+        counts = np.bincount(b, minlength=nBuckets)
+
+        pb = self.m_primBounds[idx]
+        bmin = np.full((nBuckets, 2), np.inf)
+        bmax = np.full((nBuckets, 2), -np.inf)
+        np.minimum.at(bmin, b, pb[:, :2])
+        np.maximum.at(bmax, b, pb[:, 2:])
+
+        # Bounds and counts of buckets 0..i (left) and i+1..nBuckets-1 (right)
+        lmin = np.minimum.accumulate(bmin)[:-1]
+        lmax = np.maximum.accumulate(bmax)[:-1]
+        rmin = np.minimum.accumulate(bmin[::-1])[::-1][1:]
+        rmax = np.maximum.accumulate(bmax[::-1])[::-1][1:]
+        lcount = np.cumsum(counts)[:-1]
+        rcount = len(idx) - lcount
+
+        with np.errstate(invalid='ignore'):
+            cost = lcount * (lmax - lmin).sum(axis=1) + rcount * (rmax - rmin).sum(axis=1)
+        cost[(lcount == 0) | (rcount == 0)] = np.inf
+        split = int(np.argmin(cost))
+        if not np.isfinite(cost[split]):
+            return None
+        return b <= split
+
+class EndpointGrid:
+    # Hash grid of entity endpoints, cells are tolerance-sized so a lookup
+    # only has to probe the 3x3 cells around the query point. The cells are
+    # kept as a sorted array of cell keys, which lets queryPoints look up
+    # any number of points in one vectorized pass.
+    def __init__(self, ents, tol=None):
+        self.m_ents = ents
+        self.m_tol = tol
+        self.m_indexOf = {id(ent): i for i, ent in enumerate(ents)}
+
+        # Row 2*i is the start point of entity i, row 2*i+1 its end point
+        self.m_points = np.array([(v.x, v.y) for ent in ents for v in (ent.Vertexes[0], ent.Vertexes[-1])], dtype=np.float64).reshape(-1, 2)
+        # Vec2.isclose is relative (rel_tol=1e-9), so the cell has to cover
+        # the tolerance at the largest coordinate of the layer
+        self.m_cellSize = max(1e-9 * 2.0 * (np.abs(self.m_points).max(initial=0.0) + 1.0), tol or 1e-12)
+        self.m_cells = {}
+
+        # Candidates of every endpoint of the layer in one batch query,
+        # kept as endpoint rows
+        offsets, index, end = self.queryPoints(self.m_points, tol)
+        self.m_neighborOffsets = offsets.tolist()
+        self.m_neighbors = (2 * index + end).tolist()
+        self.m_pointList = self.m_points.tolist()
+        # Naive BVHAccel, built on the first branch vertex, see ordered
+        self.m_tree = None
+
+    def _cellKeys(self, points, cellSize):
+        ij = np.floor(points / cellSize).astype(np.int64)
+        return (ij[:, 0] << 32) + ij[:, 1]
+
+    def _sortedCells(self, cellSize):
+        # Sorted cell keys of all endpoints and the endpoint rows in that order
+        if cellSize not in self.m_cells:
+            keys = self._cellKeys(self.m_points, cellSize)
+            order = np.argsort(keys, kind='stable')
+            self.m_cells[cellSize] = (keys[order], order)
+        return self.m_cells[cellSize]
+
+    def queryPoints(self, points, tol=None):
+        # For every query point, the entities with an endpoint close to it.
+        # Returns (offsets, index, end): the matches of point k are
+        # index[offsets[k]:offsets[k+1]] in entity order, end tells which end
+        # of the entity matched (0 start, 1 end). Vertexes and flags are not touched.
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        atol = 1e-12 if tol is None else tol
+        cellSize = max(self.m_cellSize, atol, 1e-9 * 2.0 * (np.abs(points).max(initial=0.0) + 1.0))
+        keys, order = self._sortedCells(cellSize)
+        qkeys = self._cellKeys(points, cellSize)
+
+        qidx = []
+        pidx = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                k = qkeys + (dx << 32) + dy
+                lo = np.searchsorted(keys, k, 'left')
+                counts = np.searchsorted(keys, k, 'right') - lo
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                first = np.cumsum(counts) - counts
+                qidx.append(np.repeat(np.arange(len(points)), counts))
+                pidx.append(order[np.arange(total) - np.repeat(first - lo, counts)])
+
+        if qidx:
+            q = np.concatenate(qidx)
+            p = np.concatenate(pidx)
+        else:
+            q = p = np.empty(0, dtype=np.intp)
+
+        # Same per-axis test as Vec2.isclose(rel_tol=1e-9, abs_tol=atol)
+        a = points[q]
+        b = self.m_points[p]
+        close = (np.abs(a - b) <= np.maximum(1e-9 * np.maximum(np.abs(a), np.abs(b)), atol)).all(axis=1)
+        q = q[close]
+        p = p[close]
+
+        sort = np.lexsort((p, q))
+        q = q[sort]
+        p = p[sort]
+        offsets = np.zeros(len(points) + 1, dtype=np.intp)
+        np.cumsum(np.bincount(q, minlength=len(points)), out=offsets[1:])
+        return offsets, p >> 1, p & 1
+
+    def candidates(self, row):
+        # Entity indexes close to endpoint row (2*i or 2*i+1), in entity order
+        return dict.fromkeys(r >> 1 for r in self.neighborRows(row))
+
+    def neighborRows(self, row):
+        # Endpoint rows close to endpoint row, row itself included
+        return self.m_neighbors[self.m_neighborOffsets[row]:self.m_neighborOffsets[row+1]]
+
+    def ordered(self, row, hint):
+        # Candidates of endpoint row in the order the naive BVHAccel visits
+        # them, hint being the other end of the entity. Where more than two
+        # ends meet the first match decides the branch, so the join stays
+        # the one of the BVH. Without a tolerance an entity whose bounds miss
+        # the point is left out as well, the BVH never reaches it.
+        # Joined entities never match, the entity itself among them
+        cands = [i for i in self.candidates(row) if not self.m_ents[i].joined]
+        if self.m_tol is None:
+            cands = [i for i in cands if self._reaches(i, self.m_pointList[row])]
+        if len(cands) <= 1:
+            return cands
+        if self.m_tree is None:
+            tree = BVHAccel(self.m_ents)
+            offsets = np.array(tree.m_offsets, dtype=np.int64)
+            parent = np.full(len(offsets), -1, dtype=np.int64)
+            inner = np.flatnonzero(offsets >= 0)
+            parent[inner + 1] = inner
+            parent[offsets[inner]] = inner
+            leaves = np.flatnonzero(offsets < 0)
+            leafOf = np.empty(len(self.m_ents), dtype=np.int64)
+            leafOf[-1 - offsets[leaves]] = leaves
+            self.m_tree = (tree.m_bounds, parent.tolist(), leafOf.tolist())
+        bounds, parent, leafOf = self.m_tree
+        leftFirst = {}
+        def path(i):
+            # 0 for the child visited first at every node from the root
+            key = []
+            node = leafOf[i]
+            while parent[node] >= 0:
+                p = parent[node]
+                if p not in leftFirst:
+                    l = 4 * (p + 1)
+                    leftFirst[p] = bounds[l] <= hint.x <= bounds[l+2] and bounds[l+1] <= hint.y <= bounds[l+3]
+                key.append((node != p + 1) == leftFirst[p])
+                node = p
+            return key[::-1]
+        return sorted(cands, key=path)
+
+    def _reaches(self, i, pt):
+        # True if the bounds of entity i hold pt, always for its own endpoints
+        if pt in (self.m_pointList[2*i], self.m_pointList[2*i+1]):
+            return True
+        xmin, ymin, xmax, ymax = self.m_ents[i].get_extents()
+        return xmin <= pt[0] <= xmax and ymin <= pt[1] <= ymax
+
+    def findNextEntity(self, entity_list):
+        # For Next Entity, consider entity_list[-1]
+        myEnt = entity_list[-1]
+        st, end = (1, 0) if myEnt.reverse else (0, 1)
+        for i in self.ordered(2 * self.m_indexOf[id(myEnt)] + end, myEnt.Vertexes[-st]):
+            if matchNext(self.m_ents[i], myEnt, self.m_tol):
+                return self.m_ents[i]
+        return None
+
+    def findPreviousEntity(self, reversed_polys):
+        # For Previous Entity
+        myEnt = reversed_polys[-1]
+        st, end = (1, 0) if myEnt.reverse else (0, 1)
+        for i in self.ordered(2 * self.m_indexOf[id(myEnt)] + st, myEnt.Vertexes[-end]):
+            if matchPrevious(self.m_ents[i], myEnt, self.m_tol):
+                return self.m_ents[i]
+        return None
+
+def ezisclose(v1, v2, tol=None):
+    if tol is None:
+        return v1.isclose(v2)
+    return v1.isclose(v2, abs_tol=tol)
+
+def matchNext(ent, myEnt, tol=None):
+    # True if ent connects to the end of myEnt, ent.reverse is set when
+    # it is met end to end
+    if myEnt.reverse == False:
+        st,end = 0,-1
+    else:
+        st,end = -1,0
+
+    # Find itself
+    if ent == myEnt or ent.joined:
+        return False
+
+    # end connect start
+    if ezisclose(ent.Vertexes[0], myEnt.Vertexes[end], tol):
+        #if myEnt start connect find_ent end
+        return not (ezisclose(ent.Vertexes[-1], myEnt.Vertexes[st], tol) and bothStraight(ent, myEnt))
+
+    # end connect end
+    elif ezisclose(ent.Vertexes[-1], myEnt.Vertexes[end], tol):
+        #if myEnt start connect find_ent start
+        if ezisclose(ent.Vertexes[0], myEnt.Vertexes[st], tol) and bothStraight(ent, myEnt):
+            return False
+        ent.reverse = True
+        return True
+
+    return False
+
+def matchPrevious(ent, myEnt, tol=None):
+    # True if ent connects to the start of myEnt, ent.reverse is set when
+    # it is met start to start
+    if myEnt.reverse == False:
+        st,end = 0,-1
+    else:
+        st,end = -1,0
+
+    # Find itself
+    if ent == myEnt or ent.joined:
+        return False
+
+    # end connect start
+    if ezisclose(ent.Vertexes[-1], myEnt.Vertexes[st], tol):
+        #if myEnt end connect find_ent start
+        return not (ezisclose(ent.Vertexes[0], myEnt.Vertexes[end], tol) and bothStraight(ent, myEnt))
+
+    # start connect start
+    elif ezisclose(ent.Vertexes[0], myEnt.Vertexes[st], tol):
+        #if myEnt end connect find_ent end
+        if ezisclose(ent.Vertexes[-1], myEnt.Vertexes[end], tol) and bothStraight(ent, myEnt):
+            return False
+        ent.reverse = True
+        return True
+
+    return False
+
+def bothStraight(ent1, ent2):
+    # To exclude the conditon that e1 and e2 are essentially lines
+    if ent1.dxftype() != ent2.dxftype():
+        return False
+    return ent1.dxftype() in ("LINE", "LWPOLYLINE") and ent1.isStraight() and ent2.isStraight()
+
+def ezJoinPolys(entities, tol=None, accel="grid", engine="greedy", snap=False):
+    # accel: "grid" for the endpoint hash grid, "naive" or "sah" for a BVH
+    # engine: "greedy" walks the index, "graph" uses ezJoinGraph
+    # snap: run ezsnapEntities first, the join then only meets equal points
+    if snap:
+        entities, closed = ezsnapEntities(entities, tol)
+        return [[ent] for ent in closed] + ezJoinPolys(entities, None, accel, engine)
+    if engine == "graph":
+        return ezJoinGraph(entities, tol)
+    if accel == "grid":
+        index = EndpointGrid(entities, tol)
+    else:
+        index = BVHAccel(entities, BVHAccel.splitMethod[accel.upper()])
+    sorted_polys = []
+    total = len(entities)
+    for i in range(total):
+        if entities[i].joined:
+            continue
+
+        poly_is_closed = False
+        polys = []
+        polys.append(entities[i])
+        entities[i].joined = True
+        nextEntity = index.findNextEntity(polys)
+        while nextEntity != None and (not nextEntity.joined):
+            # Check if nextEntity and polys[0] form closed polyline
+            if not nextEntity.reverse:
+                end = -1
+            else:
+                end = 0
+
+            if (len(polys) == 1):
+                e0 = polys[0]
+                if e0.dxftype() in ['ARC', 'LWPOLYLINE']:
+                    if e0.dxftype() == 'ARC':
+                        b0 = e0.bulge()
+                    else:
+                        b0 = e0.points()[-2][4]
+
+                    checkEntity = nextEntity
+                    v1 = polys[0].Vertexes[1] - polys[0].Vertexes[0]
+                    v2 = checkEntity.Vertexes[end] - polys[0].Vertexes[1]  
+                    
+                    if b0 != 0.0 and b0 * (v1.x * v2.y - v1.y * v2.x) <= 0: # Different side with the bulge
+                        checkEntity.joined = True # Temporary!!
+                        nextEntity = index.findNextEntity(polys)
+                        if nextEntity and not nextEntity.joined: # Find newEntity
+                            checkEntity.joined = False # Return to False
+                            checkEntity.reverse = False # Return to default!!
+                            if nextEntity.reverse == False:
+                                end = -1
+                            else:
+                                end = 0
+                        else:
+                            nextEntity = checkEntity # Did not find
+            else:
+                checkEntity = nextEntity
+                pl1 = polys[-2] 
+                if pl1.reverse:
+                    pl1st = -1
+                else:
+                    pl1st = 0
+                pl2 = polys[-1]
+                # Check if nextEntity is on the same side with pl1 and pl2
+                # find linear equation for pl2 : y = (y1 - y0) / (x1 - x0) * (x - x0) + y0
+                V1 = pl2.Vertexes[0] #Vec2
+                V2 = pl2.Vertexes[1] #Vec2
+                if V1.x == V2.x: # Vertical line, x = const 
+                    if (pl1.Vertexes[pl1st].x- V1.x) * (checkEntity.Vertexes[end].x - V1.x) <= 0: # pl1 start point is on the different side with checkEntity end point
+                        checkEntity.joined = True # Temporary!!
+                        nextEntity = index.findNextEntity(polys)
+                        if nextEntity and not nextEntity.joined: # Find newEntity
+                            checkEntity.joined = False # Return to False
+                            checkEntity.reverse = False # Return to default!!
+                            if nextEntity.reverse == False:
+                                end = -1
+                            else:
+                                end = 0
+                        else:
+                            nextEntity = checkEntity # Did not find
+                else:
+                    m = (V2.y - V1.y) / (V2.x - V1.x)
+                    if (pl1.Vertexes[pl1st].y - (m * (pl1.Vertexes[pl1st].x- V1.x) + V1.y)) * (checkEntity.Vertexes[end].y - (m * (checkEntity.Vertexes[end].x- V1.x) + V1.y)) <= 0:
+                        checkEntity.joined = True # Temporary!!
+                        nextEntity = index.findNextEntity(polys)
+                        if nextEntity and not nextEntity.joined: # Find newEntity
+                            checkEntity.joined = False # Return to False
+                            checkEntity.reverse = False # Return to default!!
+                            if nextEntity.reverse == False:
+                                end = -1
+                            else:
+                                end = 0
+                        else:
+                            nextEntity = checkEntity # Did not find
+
+            if ezisclose(nextEntity.Vertexes[end], polys[0].Vertexes[0], tol):
+                polys.append(nextEntity)
+                nextEntity.joined = True
+                poly_is_closed = True
+                break
+
+            # Join nextEntity
+            polys.append(nextEntity)
+            nextEntity.joined = True
+
+            # find nextEntity
+            nextEntity = index.findNextEntity(polys)
+        
+        if (not poly_is_closed):
+            reverse_polys = []
+            # Use polys[0] to find previousEntity
+            previousEntity = index.findPreviousEntity([polys[0]])
+
+            while previousEntity != None and (not previousEntity.joined):
+                # Join previousEntity
+                reverse_polys.append(previousEntity)
+                previousEntity.joined = True
+
+                # find previousEntity
+                previousEntity = index.findPreviousEntity(reverse_polys)
+
+            polys = reverse_polys[::-1] + polys
+
+        sorted_polys.append(polys)
+        #print("\rProgressing : {}%".format(int(100*(i+1)/total)), end='', flush=True)  
+    #print("\n", end='', flush=True)  
+    return sorted_polys
+
+class EndpointGraph:
+    # Endpoints clustered into vertices, entity i is the edge between the
+    # vertices of endpoint rows 2*i and 2*i+1. Entities snapped by
+    # ezsnapEntities bring their cluster ids, otherwise close endpoints are
+    # clustered here with ezclusterRows.
+    def __init__(self, ents, tol=None):
+        self.m_ents = ents
+        if ents and all(ent.clusters is not None for ent in ents):
+            vertexOf = [c for ent in ents for c in ent.clusters]
+            # renumber the clusters of this subset
+            ids = {}
+            vertexOf = [ids.setdefault(c, len(ids)) for c in vertexOf]
+            nv = len(ids)
+        else:
+            vertexOf, roots = ezclusterRows(EndpointGrid(ents, tol))
+            nv = len(roots)
+        self.m_vertexOf = vertexOf
+        # Endpoint rows at each vertex, edges closing on one vertex excluded
+        self.m_incident = [[] for v in range(nv)]
+        for r in range(len(vertexOf)):
+            if vertexOf[r] != vertexOf[r ^ 1]:
+                self.m_incident[vertexOf[r]].append(r)
+
+    def isLoop(self, i):
+        return self.m_vertexOf[2 * i] == self.m_vertexOf[2 * i + 1]
+
+    def canPair(self, r1, r2):
+        # Two straight edges between the same two vertices are not joined,
+        # same as the bothStraight test of matchNext
+        if r1 >> 1 == r2 >> 1:
+            return False
+        if self.m_vertexOf[r1 ^ 1] == self.m_vertexOf[r2 ^ 1]:
+            return not bothStraight(self.m_ents[r1 >> 1], self.m_ents[r2 >> 1])
+        return True
+
+    def direction(self, r):
+        # Unit tangent leaving endpoint row r along its entity
+        ent = self.m_ents[r >> 1]
+        if ent.dxftype() == 'LWPOLYLINE':
+            pts = ent.points()
+            if r & 1:
+                a, b, bulge = Vec2(pts[-1][:2]), Vec2(pts[-2][:2]), -pts[-2][4]
+            else:
+                a, b, bulge = Vec2(pts[0][:2]), Vec2(pts[1][:2]), pts[0][4]
+        else:
+            a, b = ent.Vertexes
+            bulge = ent.bulge() if ent.dxftype() == 'ARC' else 0.0
+            if r & 1:
+                a, b, bulge = b, a, -bulge
+        chord = b - a
+        if chord.is_null:
+            return chord
+        # the tangent is the chord turned back by half the included angle,
+        # clockwise for a positive (counterclockwise) bulge
+        return chord.normalize().rotate(-2.0 * math.atan(bulge))
+
+def ezclusterRows(grid):
+    # Union-find over the endpoint rows of grid, rows matched by the grid
+    # end up in one cluster, also through chains of matches. Returns the
+    # cluster id of every row, numbered in order of their lowest row, and
+    # that lowest row of every cluster.
+    n = len(grid.m_points)
+    parent = list(range(n))
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+    for r in range(n):
+        for t in grid.neighborRows(r):
+            if t > r:
+                a, b = find(r), find(t)
+                # the lower row stays the root
+                if a < b:
+                    parent[b] = a
+                elif b < a:
+                    parent[a] = b
+    ids = {}
+    labels = [ids.setdefault(find(r), len(ids)) for r in range(n)]
+    return labels, list(ids)
+
+def ezsnapEntities(entities, tol=None):
+    # Pre-join pass: cluster the endpoints of entities within tol and move
+    # every endpoint onto the lowest endpoint of its cluster, so that the
+    # join compares equal points and integer ids (ent.clusters). LINEs
+    # shrinking to one cluster are dropped, LWPOLYLINEs whose ends meet
+    # are closed. Returns (entities to join, closed entities), views of a
+    # copy of their LayerGeometry, the caller's is left as it was.
+    copies = {}
+    for ent in entities:
+        if id(ent.m_geom) not in copies:
+            copies[id(ent.m_geom)] = ent.m_geom.take(range(len(ent.m_geom)))
+    entities = [myEntity(copies[id(ent.m_geom)], ent.m_index) for ent in entities]
+    grid = EndpointGrid(entities, tol)
+    labels, roots = ezclusterRows(grid)
+    reps = grid.m_points[roots].tolist()
+    kept = []
+    closed = []
+    for i, ent in enumerate(entities):
+        a, b = labels[2*i], labels[2*i+1]
+        if ent.dxftype() == 'LINE' and a == b:
+            continue
+        # for an ARC only the join vertexes move, it keeps center and radius
+        ent.m_geom.moveEnds(ent.m_index, reps[a], reps[b])
+        ent.Vertexes = ent.getVertexes()
+        if ent.dxftype() == 'LWPOLYLINE' and a == b:
+            ent.m_geom.setClosed(ent.m_index)
+            closed.append(ent)
+            continue
+        ent.clusters = (a, b)
+        kept.append(ent)
+    return kept, closed
+
+def smallestTurn(graph, rows):
+    # Branch policy: pair the edges at a vertex so that the chains going
+    # through it turn as little as possible
+    dirs = {r: graph.direction(r) for r in rows}
+    pairs = sorted((dirs[a].dot(dirs[b]), a, b) for k, a in enumerate(rows) for b in rows[k+1:] if graph.canPair(a, b))
+    free = set(rows)
+    paired = []
+    for cost, a, b in pairs:
+        if a in free and b in free:
+            paired.append((a, b))
+            free.discard(a)
+            free.discard(b)
+    return paired
+
+def entityOrder(graph, rows):
+    # Branch policy: pair the edges at a vertex in entity order
+    free = list(rows)
+    paired = []
+    while free:
+        a = free.pop(0)
+        for b in free:
+            if graph.canPair(a, b):
+                paired.append((a, b))
+                free.remove(b)
+                break
+    return paired
+
+def ezJoinGraph(entities, tol=None, policy=smallestTurn):
+    # Join by chain extraction on the endpoint graph. Every vertex pairs its
+    # edges once (degree 2 directly, branches through policy), after which
+    # each edge has at most one successor per end and the chains and closed
+    # loops are read off in one walk. Same result format as ezJoinPolys.
+    graph = EndpointGraph(entities, tol)
+    partner = [None] * (2 * len(entities))
+    for rows in graph.m_incident:
+        if len(rows) == 2:
+            paired = [tuple(rows)] if graph.canPair(rows[0], rows[1]) else []
+        elif len(rows) > 2:
+            paired = policy(graph, rows)
+        else:
+            paired = []
+        for a, b in paired:
+            partner[a] = b
+            partner[b] = a
+
+    used = [False] * len(entities)
+    def walk(r):
+        # Enter the entity of row r at r, leave it by r^1, go on with the partner
+        chain = []
+        while r is not None and not used[r >> 1]:
+            used[r >> 1] = True
+            chain.append(r)
+            r = partner[r ^ 1]
+        return chain
+
+    chains = []
+    for i in range(len(entities)):
+        if graph.isLoop(i):
+            used[i] = True
+            chains.append([2 * i])
+    # Open chains start at the ends left unpaired, what remains are loops
+    for r in range(2 * len(entities)):
+        if partner[r] is None and not used[r >> 1]:
+            chains.append(walk(r))
+    for i in range(len(entities)):
+        if not used[i]:
+            chains.append(walk(2 * i))
+
+    # Like the greedy join: chains in order of their lowest entity, which
+    # runs forward and starts the loop it is in
+    chains.sort(key=lambda chain: min(chain) >> 1)
+    sorted_polys = []
+    for chain in chains:
+        closed = partner[chain[0]] is not None
+        k = min(range(len(chain)), key=lambda j: chain[j])
+        if chain[k] & 1:
+            chain = [r ^ 1 for r in reversed(chain)]
+            k = len(chain) - 1 - k
+        if closed:
+            chain = chain[k:] + chain[:k]
+        polys = []
+        for r in chain:
+            ent = entities[r >> 1]
+            ent.reverse = bool(r & 1)
+            ent.joined = True
+            polys.append(ent)
+        sorted_polys.append(polys)
+    return sorted_polys
+
+class myEntity:
+    # Join view of row m_index of a LayerGeometry, see LayerGeometry.entities()
+    __slots__ = ('m_geom', 'm_index', 'reverse', 'joined', 'clusters', 'Vertexes')
+
+    def __init__(self, geom, index):
+        self.m_geom = geom
+        self.m_index = index
+        self.reverse = False
+        self.joined = False
+        # (start, end) endpoint cluster ids, set by ezsnapEntities
+        self.clusters = None
+        self.Vertexes = self.getVertexes()
+
+    def dxftype(self):
+        return self.m_geom.kind(self.m_index)
+
+    def points(self):
+        # LWPOLYLINE vertices as (x, y, start_width, end_width, bulge)
+        return self.m_geom.points(self.m_index)
+
+    def bulge(self):
+        # ARC bulge from start to end, signed by the extrusion
+        return self.m_geom.m_bulge[self.m_index]
+
+    def isStraight(self):
+        return bool(self.m_geom.m_straight[self.m_index])
+
+    def get_bounds(self):
+        if self.dxftype() == 'LWPOLYLINE':
+            bbox = BoundingBox2d()
+            bbox.extend(p[:2] for p in self.points())
+            return bbox
+        return BoundingBox2d(self.Vertexes)
+
+    def get_extents(self):
+        # xmin, ymin, xmax, ymax of get_bounds() without building a BoundingBox2d
+        if self.dxftype() == 'LWPOLYLINE':
+            bbox = self.get_bounds()
+            return (bbox.extmin.x, bbox.extmin.y, bbox.extmax.x, bbox.extmax.y)
+        v0, v1 = self.Vertexes
+        return (min(v0.x, v1.x), min(v0.y, v1.y), max(v0.x, v1.x), max(v0.y, v1.y))
+
+    def getVertexes(self):
+        return self.m_geom.vertexes(self.m_index)
+
+class GeometryRow:
+    # Drawing view of row m_index of a LayerGeometry, see LayerGeometry.query().
+    # Offers the part of the ezdxf entity interface the FreeCAD drawing
+    # reads: dxftype, dxf attributes, ocs and for LWPOLYLINE len, indexing,
+    # get_points and is_closed.
+    __slots__ = ('m_geom', 'm_index', 'm_points', 'dxf')
+
+    def __init__(self, geom, index):
+        self.m_geom = geom
+        self.m_index = index
+        raw = geom.raw(index)
+        self.m_points = raw[1] if raw[0] == 'LWPOLYLINE' else None
+        if raw[0] == 'LINE':
+            self.dxf = SimpleNamespace(start=raw[1], end=raw[2])
+        elif raw[0] == 'ARC':
+            self.dxf = SimpleNamespace(center=raw[1], radius=raw[2], start_angle=raw[3], end_angle=raw[4], extrusion=raw[5])
+        elif raw[0] == 'CIRCLE':
+            self.dxf = SimpleNamespace(center=raw[1], radius=raw[2], extrusion=raw[3])
+        else:
+            self.dxf = SimpleNamespace(const_width=raw[2], elevation=raw[4])
+
+    def dxftype(self):
+        return self.m_geom.kind(self.m_index)
+
+    def ocs(self):
+        return OCS(self.dxf.extrusion)
+
+    @property
+    def is_closed(self):
+        return bool(self.m_geom.m_params[self.m_index, 1])
+
+    def __len__(self):
+        return len(self.m_points)
+
+    def __getitem__(self, i):
+        return self.m_points[i]
+
+    def get_points(self, format='xyseb'):
+        fields = ['xyseb'.index(c) for c in format]
+        return [tuple(v[f] for f in fields) for v in self.m_points]
+
+def ezchainRaw(ent_list, tol=None):
+    # Packed entity of one joined chain: the entity itself when alone,
+    # otherwise one LWPOLYLINE through all of them
+    if len(ent_list) == 1:
+        return ent_list[0].m_geom.raw(ent_list[0].m_index)
+
+    vertexes = []
+    line_width = 0
+    set_width = False
+
+    # Add start vertex to vertexes!
+    for myEnt in ent_list:
+        if myEnt.reverse == False:
+            start = 0
+        else:
+            start = -1
+
+        if myEnt.dxftype() == 'LINE':
+            vertexes.append((myEnt.Vertexes[start].x, myEnt.Vertexes[start].y, 0, 0, 0))
+
+        elif myEnt.dxftype() == 'ARC':
+            if myEnt.reverse == False:
+                vertexes.append((myEnt.Vertexes[start].x, myEnt.Vertexes[start].y, 0, 0, myEnt.bulge()))
+            else:
+                vertexes.append((myEnt.Vertexes[start].x, myEnt.Vertexes[start].y, 0, 0, -myEnt.bulge()))
+
+        elif myEnt.dxftype() == 'LWPOLYLINE':
+            pts = myEnt.points()
+            if not set_width:
+                line_width = myEnt.m_geom.m_params[myEnt.m_index, 0]
+                set_width = True
+            if myEnt.reverse == False:
+                vertexes += pts[:-1:]
+            else:
+                m = len(pts)
+                rev_pts = [(pts[m-i-1][0], pts[m-i-1][1], pts[m-i-1][3], pts[m-i-1][2], -pts[m-i-2][4]) for i in range(m)]
+                vertexes += rev_pts[:-1:]
+
+    # Obtain is_poly_closed
+    is_poly_closed = False
+    first_ent = ent_list[0]
+    last_ent = ent_list[-1]
+
+    if first_ent.reverse == False:
+        start = 0
+    else:
+        start = -1
+
+    if last_ent.reverse == False:
+        end = -1
+    else:
+        end = 0
+
+    if ezisclose(first_ent.Vertexes[start], last_ent.Vertexes[end], tol):
+        is_poly_closed = True
+    else:
+        #Add last_end Vertexes[end]
+        vertexes.append((last_ent.Vertexes[end].x, last_ent.Vertexes[end].y, 0, 0, 0))
+
+    return ('LWPOLYLINE', vertexes, float(line_width), is_poly_closed, 0.0)
+
+def ezgetBulge(arc):
+    span_angle = arc_angle_span_deg(arc.dxf.start_angle, arc.dxf.end_angle)
+    V1 = arc.start_point
+    V2 = arc.end_point
+    center = arc.dxf.center
+    radius = arc.dxf.radius
+    M = (V1 + V2)/2
+    epsilon = 0.0001
+    if span_angle < 180 - epsilon:
+        d = radius * (M - center).normalize()
+    elif abs(span_angle - 180.0) < epsilon:
+            return 1.0
+    else:
+        d = radius * (center - M).normalize()
+    S = center + d
+    return S.distance(M) / V2.distance(M)
+
+class EntityIndex:
+    # Entities of a layout bucketed by layer and by (layer, dxftype) in a
+    # single pass, replaces one layout.query() scan per layer and type.
+    # m_touched counts the entities the pass went through.
+    def __init__(self, layout, layers=None):
+        self.m_byLayer = {}
+        self.m_byType = {}
+        self.m_touched = 0
+        if layers is not None:
+            layers = set(layers)
+        for e in layout:
+            self.m_touched += 1
+            l = e.dxf.layer
+            if layers is not None and l not in layers:
+                continue
+            self.m_byLayer.setdefault(l, []).append(e)
+            self.m_byType.setdefault((l, e.dxftype()), []).append(e)
+
+    def layer(self, l):
+        # All entities of layer l in layout order
+        return self.m_byLayer.get(l, [])
+
+    def query(self, l, dxftype):
+        return self.m_byType.get((l, dxftype), [])
+
+# ===== Raw geometry for worker processes and the layer cache =====
+# One entity as a plain tuple, the row format of LayerGeometry:
+#   ('LINE', (x0, y0, z0), (x1, y1, z1))
+#   ('ARC', (cx, cy, cz), radius, start_angle, end_angle, extrusion)
+#   ('CIRCLE', (cx, cy, cz), radius, extrusion)
+#   ('LWPOLYLINE', [(x, y, start_width, end_width, bulge), ...], const_width, closed, elevation)
+
+def ezpackEntity(e):
+    if e.dxftype() == 'LINE':
+        return ('LINE', tuple(e.dxf.start), tuple(e.dxf.end))
+    elif e.dxftype() == 'ARC':
+        return ('ARC', tuple(e.dxf.center), e.dxf.radius, e.dxf.start_angle, e.dxf.end_angle, tuple(e.dxf.extrusion))
+    elif e.dxftype() == 'LWPOLYLINE':
+        return ('LWPOLYLINE', [tuple(p) for p in e.get_points()], e.dxf.const_width, e.closed, e.dxf.elevation)
+    elif e.dxftype() == 'CIRCLE':
+        return ('CIRCLE', tuple(e.dxf.center), e.dxf.radius, tuple(e.dxf.extrusion))
+
+def ezunpackEntity(raw, msp, dxfattribs=None):
+    attribs = dict(dxfattribs or {})
+    if raw[0] == 'LINE':
+        return msp.add_line(raw[1], raw[2], dxfattribs=attribs)
+    elif raw[0] == 'ARC':
+        attribs["extrusion"] = raw[5]
+        return msp.add_arc(raw[1], raw[2], raw[3], raw[4], dxfattribs=attribs)
+    elif raw[0] == 'LWPOLYLINE':
+        attribs["const_width"] = raw[2]
+        attribs["elevation"] = raw[4]
+        return msp.add_lwpolyline(raw[1], format="xyseb", close=raw[3], dxfattribs=attribs)
+    elif raw[0] == 'CIRCLE':
+        attribs["extrusion"] = raw[3]
+        return msp.add_circle(raw[1], raw[2], dxfattribs=attribs)
+
+class LayerGeometry:
+    # Columnar geometry of a layer, built once when the layer is read and
+    # handed to the join, the worker processes, the layer cache and the
+    # session instead of ezdxf entities. Row i of every array is entity i:
+    #   kind       index into KINDS
+    #   params     LINE x0 y0 z0 x1 y1 z1 | ARC cx cy cz r start end
+    #              | CIRCLE cx cy cz r | LWPOLYLINE const_width closed elevation
+    #   extrusion  ARC, CIRCLE extrusion vector
+    #   voffsets   LWPOLYLINE i owns verts[voffsets[i]:voffsets[i+1]]
+    #   verts      x y start_width end_width bulge
+    #   handle     source entity handle, 0 for virtual entities
+    # The join columns are derived on first use: start, end (join vertexes),
+    # bulge (ARC bulge signed by the extrusion) and straight (LINE or
+    # LWPOLYLINE without bulges).
+    KINDS = ('LINE', 'ARC', 'CIRCLE', 'LWPOLYLINE')
+    ARRAYS = ('kind', 'params', 'extrusion', 'voffsets', 'verts', 'handle')
+
+    def __init__(self, kind, params, extrusion, voffsets, verts, handle):
+        self.m_kind = kind
+        self.m_params = params
+        self.m_extrusion = extrusion
+        self.m_voffsets = voffsets
+        self.m_verts = verts
+        self.m_handle = handle
+        self.m_start = None
+        self.m_lists = None
+
+    @classmethod
+    def fromRaws(cls, raws, handles=None):
+        n = len(raws)
+        kind = np.zeros(n, dtype=np.uint8)
+        params = np.zeros((n, 6), dtype=np.float64)
+        extrusion = np.zeros((n, 3), dtype=np.float64)
+        voffsets = np.zeros(n + 1, dtype=np.int64)
+        verts = []
+        for i, raw in enumerate(raws):
+            kind[i] = cls.KINDS.index(raw[0])
+            if raw[0] == 'LINE':
+                params[i] = tuple(raw[1]) + tuple(raw[2])
+            elif raw[0] == 'ARC':
+                params[i] = tuple(raw[1]) + (raw[2], raw[3], raw[4])
+                extrusion[i] = raw[5]
+            elif raw[0] == 'CIRCLE':
+                params[i, :4] = tuple(raw[1]) + (raw[2],)
+                extrusion[i] = raw[3]
+            elif raw[0] == 'LWPOLYLINE':
+                params[i, :3] = (raw[2], raw[3], raw[4])
+                verts.extend(raw[1])
+            voffsets[i+1] = len(verts)
+        handle = np.zeros(n, dtype=np.int64) if handles is None else np.array(handles, dtype=np.int64)
+        return cls(kind, params, extrusion, voffsets, np.array(verts, dtype=np.float64).reshape(-1, 5), handle)
+
+    @classmethod
+    def fromEntities(cls, ents):
+        ents = list(ents)
+        return cls.fromRaws([ezpackEntity(e) for e in ents], [int(e.dxf.handle or "0", 16) for e in ents])
+
+    @classmethod
+    def fromArrays(cls, data):
+        return cls(*(np.asarray(data[name]) for name in cls.ARRAYS))
+
+    def arrays(self):
+        return {name: getattr(self, "m_" + name) for name in self.ARRAYS}
+
+    def __len__(self):
+        return len(self.m_kind)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays().values())
+
+    def _rows(self):
+        # The arrays as Python lists for row access
+        if self.m_lists is None:
+            self.m_lists = (self.m_kind.tolist(), self.m_params.tolist(), self.m_extrusion.tolist(),
+                            self.m_voffsets.tolist(), self.m_verts.tolist())
+        return self.m_lists
+
+    def kind(self, i):
+        return self.KINDS[self._rows()[0][i]]
+
+    def points(self, i):
+        kind, params, extrusion, voffsets, verts = self._rows()
+        return [tuple(v) for v in verts[voffsets[i]:voffsets[i+1]]]
+
+    def raw(self, i):
+        kind, params, extrusion, voffsets, verts = self._rows()
+        p = params[i]
+        if self.KINDS[kind[i]] == 'LINE':
+            return ('LINE', tuple(p[0:3]), tuple(p[3:6]))
+        elif self.KINDS[kind[i]] == 'ARC':
+            return ('ARC', tuple(p[0:3]), p[3], p[4], p[5], tuple(extrusion[i]))
+        elif self.KINDS[kind[i]] == 'CIRCLE':
+            return ('CIRCLE', tuple(p[0:3]), p[3], tuple(extrusion[i]))
+        return ('LWPOLYLINE', self.points(i), p[0], bool(p[1]), p[2])
+
+    def raws(self):
+        return [self.raw(i) for i in range(len(self))]
+
+    @classmethod
+    def concat(cls, geoms):
+        geoms = list(geoms)
+        voffsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for g in geoms:
+            voffsets.append(g.m_voffsets[1:] + base)
+            base += len(g.m_verts)
+        return cls(*(np.concatenate([getattr(g, "m_" + name) for g in geoms]) for name in ('kind', 'params', 'extrusion')),
+                   np.concatenate(voffsets), np.concatenate([g.m_verts for g in geoms]).reshape(-1, 5),
+                   np.concatenate([g.m_handle for g in geoms]))
+
+    def query(self, kind):
+        # GeometryRow of every row of kind, like EntityIndex.query on a layer
+        k = self.KINDS.index(kind)
+        return [GeometryRow(self, i) for i in np.flatnonzero(self.m_kind == k).tolist()]
+
+    def take(self, rows):
+        # New LayerGeometry of the given rows, in that order
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = np.diff(self.m_voffsets)[rows]
+        voffsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=voffsets[1:])
+        vrows = np.repeat(self.m_voffsets[rows] - voffsets[:-1], counts) + np.arange(voffsets[-1])
+        return LayerGeometry(self.m_kind[rows], self.m_params[rows], self.m_extrusion[rows],
+                             voffsets, self.m_verts[vrows], self.m_handle[rows])
+
+    def canonicalKeys(self, quantum=1e-6):
+        # Hashable key per row, equal for rows with the same geometry on a
+        # quantum grid. LINE and LWPOLYLINE keys ignore the direction, closed
+        # LWPOLYLINE keys the start vertex as well.
+        params = self.m_params.copy()
+        arcs = self.m_kind == self.KINDS.index('ARC')
+        params[arcs, 4:6] %= 360.0
+        quantize = lambda a: np.round(a / quantum).astype(np.int64).tolist()
+        kind, params, extrusion = self.m_kind.tolist(), quantize(params), quantize(self.m_extrusion)
+        verts, voffsets = quantize(self.m_verts), self.m_voffsets.tolist()
+        keys = []
+        for i, k in enumerate(kind):
+            p = params[i]
+            if self.KINDS[k] == 'LINE':
+                a, b = tuple(p[0:3]), tuple(p[3:6])
+                keys.append((k,) + ((a, b) if a <= b else (b, a)))
+            elif self.KINDS[k] == 'LWPOLYLINE':
+                vs = verts[voffsets[i]:voffsets[i+1]]
+                if not vs:
+                    keys.append((k, tuple(p[0:3]), ()))
+                    continue
+                # Widths and bulge belong to the segment starting at a vertex,
+                # reversed they move to its other end with the bulge negated
+                if p[1]:
+                    n = len(vs)
+                    forward = [tuple(v) for v in vs]
+                    backward = [(vs[(j+1) % n][0], vs[(j+1) % n][1], vs[j][3], vs[j][2], -vs[j][4]) for j in range(n - 1, -1, -1)]
+                    # Both start at the smallest vertex, repeated points give
+                    # more than one candidate
+                    first = min(v[0:2] for v in forward)
+                    rotations = [seq[j:] + seq[:j] for seq in (forward, backward) for j in range(n) if seq[j][0:2] == first]
+                    keys.append((k, tuple(p[0:3]), tuple(min(rotations))))
+                    continue
+                forward = tuple(tuple(v) for v in vs[:-1]) + ((vs[-1][0], vs[-1][1], 0, 0, 0),)
+                backward = tuple((vs[j+1][0], vs[j+1][1], vs[j][3], vs[j][2], -vs[j][4]) for j in range(len(vs) - 2, -1, -1)) \
+                    + ((vs[0][0], vs[0][1], 0, 0, 0),)
+                keys.append((k, tuple(p[0:3]), min(forward, backward)))
+            else:
+                keys.append((k, tuple(p), tuple(extrusion[i])))
+        return keys
+
+    def addTo(self, msp, dxfattribs=None):
+        for raw in self.raws():
+            ezunpackEntity(raw, msp, dxfattribs)
+
+    def _derive(self):
+        n = len(self)
+        kind, params, extrusion, voffsets, verts = self._rows()
+        start = np.zeros((n, 2), dtype=np.float64)
+        end = np.zeros((n, 2), dtype=np.float64)
+        bulge = np.zeros(n, dtype=np.float64)
+        straight = np.zeros(n, dtype=bool)
+        for i in range(n):
+            k = self.KINDS[kind[i]]
+            p = params[i]
+            if k == 'LINE':
+                start[i] = p[0:2]
+                end[i] = p[3:5]
+                straight[i] = True
+            elif k == 'ARC':
+                arc = ezdxf.entities.Arc.new(dxfattribs={"center": p[0:3], "radius": p[3], "start_angle": p[4],
+                                                         "end_angle": p[5], "extrusion": extrusion[i]})
+                start[i] = arc.start_point.vec2
+                end[i] = arc.end_point.vec2
+                z_orient = extrusion[i][2]
+                z_orient /= abs(z_orient)
+                bulge[i] = z_orient * ezgetBulge(arc)
+            elif k == 'CIRCLE':
+                start[i] = end[i] = p[0:2]
+            elif voffsets[i+1] > voffsets[i]:
+                start[i] = verts[voffsets[i]][0:2]
+                end[i] = verts[voffsets[i+1]-1][0:2]
+                straight[i] = all(v[4] == 0.0 for v in verts[voffsets[i]:voffsets[i+1]])
+        self.m_start, self.m_end, self.m_bulge, self.m_straight = start, end, bulge, straight
+        self.m_vertexLists = (start.tolist(), end.tolist())
+
+    def vertexes(self, i):
+        if self.m_start is None:
+            self._derive()
+        return [Vec2(self.m_vertexLists[0][i]), Vec2(self.m_vertexLists[1][i])]
+
+    def moveEnds(self, i, a, b):
+        # Move the join vertexes of entity i to the 2D points a and b, LINE
+        # and LWPOLYLINE geometry follows, an ARC keeps its center and radius
+        if self.m_start is None:
+            self._derive()
+        kind, params, extrusion, voffsets, verts = self._rows()
+        k = self.KINDS[kind[i]]
+        if k == 'LINE':
+            self.m_params[i, 0:2] = a
+            self.m_params[i, 3:5] = b
+            params[i] = self.m_params[i].tolist()
+        elif k == 'LWPOLYLINE':
+            for row, pt in ((voffsets[i], a), (voffsets[i+1] - 1, b)):
+                self.m_verts[row, 0:2] = pt
+                verts[row] = self.m_verts[row].tolist()
+        self.m_start[i] = a
+        self.m_end[i] = b
+        self.m_vertexLists[0][i] = list(a)
+        self.m_vertexLists[1][i] = list(b)
+
+    def setClosed(self, i):
+        self.m_params[i, 1] = 1.0
+        self._rows()[1][i][1] = 1.0
+
+    def entities(self):
+        # A myEntity for every row, the input of ezJoinPolys
+        return [myEntity(self, i) for i in range(len(self))]
+
+def ezJoinGeometry(geom, tol=None, accel="grid", engine="greedy", snap=False):
+    # Join the LINE, ARC and LWPOLYLINE rows of geom, returns the chains as
+    # a new LayerGeometry. Runs in the worker processes of the parallel join.
+    sorted_entities = ezJoinPolys(geom.entities(), tol, accel, engine, snap)
+    return LayerGeometry.fromRaws([ezchainRaw(poly, tol) for poly in sorted_entities])
+
+def ezdedupeGeometry(geom, quantum=1e-6):
+    # Drop the rows that repeat an earlier row's geometry, see
+    # LayerGeometry.canonicalKeys. Returns (geometry, number removed).
+    seen = set()
+    keep = []
+    for i, key in enumerate(geom.canonicalKeys(quantum)):
+        if key not in seen:
+            seen.add(key)
+            keep.append(i)
+    if len(keep) == len(geom):
+        return geom, 0
+    return geom.take(keep), len(geom) - len(keep)
+
+def ezendpointKeys(geom, quantum=1e-6):
+    # Quantized 2D (start, end) of every row, ARC ends from the OCS angles,
+    # None for a CIRCLE or an empty LWPOLYLINE
+    kind, params = geom.m_kind, geom.m_params
+    ends = np.zeros((len(geom), 4), dtype=np.float64)
+    ends[:, 0:2] = params[:, 0:2]
+    ends[:, 2:4] = params[:, 3:5]
+    arcs = kind == LayerGeometry.KINDS.index('ARC')
+    for col, angle in ((0, params[arcs, 4]), (2, params[arcs, 5])):
+        ends[arcs, col] = params[arcs, 0] + params[arcs, 3] * np.cos(np.radians(angle))
+        ends[arcs, col+1] = params[arcs, 1] + params[arcs, 3] * np.sin(np.radians(angle))
+    ends[arcs, 0::2] *= np.where(geom.m_extrusion[arcs, 2:3] < 0, -1.0, 1.0)
+    polys = np.flatnonzero((kind == LayerGeometry.KINDS.index('LWPOLYLINE')) & (np.diff(geom.m_voffsets) > 0))
+    ends[polys, 0:2] = geom.m_verts[geom.m_voffsets[polys], 0:2]
+    ends[polys, 2:4] = geom.m_verts[geom.m_voffsets[polys+1] - 1, 0:2]
+    ends = np.round(ends / quantum).astype(np.int64).tolist()
+    hasEnds = np.where(kind == LayerGeometry.KINDS.index('LWPOLYLINE'), np.diff(geom.m_voffsets) > 0,
+                       kind != LayerGeometry.KINDS.index('CIRCLE'))
+    return [((e[0], e[1]), (e[2], e[3])) if h else None for e, h in zip(ends, hasEnds.tolist())]
+
+def ezmergeLines(geom, quantum=1e-6):
+    # Merge the LINE rows that lie on one line and overlap or touch into a
+    # LINE over their whole extent, kept in the row of the first piece.
+    # Lines are grouped on direction, offset and z on a quantum grid and
+    # swept along the direction. A point where a row off the line ends is
+    # a junction of the join, no merge buries it inside a LINE.
+    # Returns (geometry, number removed).
+    lines = np.flatnonzero(geom.m_kind == LayerGeometry.KINDS.index('LINE'))
+    if len(lines) < 2:
+        return geom, 0
+    p = geom.m_params[lines]
+    d = p[:, 3:5] - p[:, 0:2]
+    length = np.hypot(d[:, 0], d[:, 1])
+    flat = (length > quantum) & (np.abs(p[:, 5] - p[:, 2]) <= quantum)
+    u = d / np.where(length > 0, length, 1.0)[:, None]
+    qu = np.round(u / quantum).astype(np.int64)
+    flip = (qu[:, 0] < 0) | ((qu[:, 0] == 0) & (qu[:, 1] < 0))
+    u[flip] *= -1
+    qu[flip] *= -1
+    offset = np.round((u[:, 0] * p[:, 1] - u[:, 1] * p[:, 0]) / quantum).astype(np.int64)
+    z = np.round(p[:, 2] / quantum).astype(np.int64)
+    t0 = (u * p[:, 0:2]).sum(axis=1)
+    t1 = (u * p[:, 3:5]).sum(axis=1)
+
+    groups = {}
+    for j, key in enumerate(zip(qu[:, 0].tolist(), qu[:, 1].tolist(), offset.tolist(), z.tolist())):
+        if flat[j]:
+            groups.setdefault(key, []).append(j)
+    groups = list(groups.values())
+    group = np.full(len(geom), -1, dtype=np.int64)
+    for g, members in enumerate(groups):
+        group[lines[members]] = g
+
+    # Group of the rows ending at each point, -1 when rows of different
+    # groups or rows off any group end there
+    ends = ezendpointKeys(geom, quantum)
+    owner = {}
+    for i, g in enumerate(group.tolist()):
+        if ends[i] is None:
+            continue
+        for pt in ends[i]:
+            if owner.setdefault(pt, g) != g:
+                owner[pt] = -1
+
+    params = geom.m_params.copy()
+    drop = []
+    t0, t1, flip = t0.tolist(), t1.tolist(), flip.tolist()
+    for g, members in enumerate(groups):
+        if len(members) < 2:
+            continue
+        # lo and hi end of each piece along the line: (t, point, 3D end)
+        pieces = []
+        for j in members:
+            row = int(lines[j])
+            a, b = (t0[j], ends[row][0], params[row, 0:3].copy()), (t1[j], ends[row][1], params[row, 3:6].copy())
+            pieces.append((min(a, b, key=lambda e: e[0]), max(a, b, key=lambda e: e[0]), row))
+        pieces.sort(key=lambda piece: piece[0][0])
+        runs = []
+        for lo, hi, row in pieces:
+            if runs:
+                run = runs[-1]
+                buried = []
+                if lo[0] > run[0][0] + quantum:
+                    buried.append(lo[1])
+                if hi[0] > run[1][0] + quantum:
+                    buried.append(run[1][1])
+                elif hi[0] < run[1][0] - quantum:
+                    buried.append(hi[1])
+                if lo[0] <= run[1][0] + quantum and all(owner[pt] == g for pt in buried):
+                    if hi[0] > run[1][0]:
+                        run[1] = hi
+                    run[2].append(row)
+                    continue
+            runs.append([lo, hi, [row]])
+        for lo, hi, rows in runs:
+            if len(rows) < 2:
+                continue
+            keep = min(rows)
+            # The kept row keeps its direction
+            reverse = flip[int(np.searchsorted(lines, keep))]
+            params[keep, 0:3], params[keep, 3:6] = (hi[2], lo[2]) if reverse else (lo[2], hi[2])
+            drop.extend(row for row in rows if row != keep)
+    if not drop:
+        return geom, 0
+    merged = LayerGeometry(geom.m_kind, params, geom.m_extrusion, geom.m_voffsets, geom.m_verts, geom.m_handle)
+    return merged.take(np.setdiff1d(np.arange(len(geom)), drop)), len(drop)
+
+def ezdouglasPeucker(pts, tol, keep):
+    # Mark in keep the vertexes of the straight run pts (its ends already
+    # kept) that stay when every dropped vertex is within tol of the chord
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        s, e = stack.pop()
+        if e - s < 2:
+            continue
+        a, b = pts[s], pts[e]
+        ab = b - a
+        ap = pts[s+1:e] - a
+        length2 = ab @ ab
+        t = np.clip(ap @ ab / length2, 0.0, 1.0) if length2 > 0 else np.zeros(len(ap))
+        d = np.hypot(*(ap - t[:, None] * ab).T)
+        i = int(np.argmax(d))
+        if d[i] > tol:
+            keep[s+1+i] = True
+            stack.append((s, s+1+i))
+            stack.append((s+1+i, e))
+
+def ezsimplifyPolylines(geom, tol, quantum=1e-6):
+    # Drop LWPOLYLINE vertexes of straight runs with Douglas-Peucker within
+    # the chord tolerance tol. Vertexes of bulge or width segments, the ends
+    # of a polyline and vertexes where another row ends are kept; a closed
+    # polyline also keeps its vertex farthest from the first.
+    # Returns (geometry, number of vertexes removed).
+    polys = np.flatnonzero((geom.m_kind == LayerGeometry.KINDS.index('LWPOLYLINE')) & (np.diff(geom.m_voffsets) > 2))
+    if not tol or len(polys) == 0:
+        return geom, 0
+    # Row ending at each point, -1 when more than one
+    owner = {}
+    for row, ends in enumerate(ezendpointKeys(geom, quantum)):
+        for pt in ends or ():
+            if owner.setdefault(pt, row) != row:
+                owner[pt] = -1
+    verts = geom.m_verts
+    keys = np.round(verts[:, 0:2] / quantum).astype(np.int64).tolist()
+    keep = np.ones(len(verts), dtype=bool)
+    for i in polys.tolist():
+        lo, hi = int(geom.m_voffsets[i]), int(geom.m_voffsets[i+1])
+        closed = bool(geom.m_params[i, 1])
+        # A closed polyline walks back to its first vertex
+        rows = np.append(np.arange(lo, hi), lo) if closed else np.arange(lo, hi)
+        pts = verts[rows, 0:2]
+        plain = (verts[rows[:-1], 2:5] == 0.0).all(axis=1)
+        anchor = np.zeros(len(rows), dtype=bool)
+        anchor[[0, -1]] = True
+        anchor[:-1] |= ~plain
+        anchor[1:] |= ~plain
+        anchor |= np.array([owner.get(tuple(keys[r]), i) != i for r in rows.tolist()])
+        if closed and anchor.sum() == 2:
+            anchor[int(np.argmax(np.hypot(*(pts - pts[0]).T)))] = True
+        marks = anchor.copy()
+        cuts = np.flatnonzero(anchor)
+        for s, e in zip(cuts[:-1].tolist(), cuts[1:].tolist()):
+            if e - s > 1:
+                run = marks[s:e+1]
+                ezdouglasPeucker(pts[s:e+1], tol, run)
+        keep[lo:hi] = marks[:hi - lo]
+    removed = int(len(keep) - keep.sum())
+    if removed == 0:
+        return geom, 0
+    kept = np.zeros(len(verts) + 1, dtype=np.int64)
+    np.cumsum(keep, out=kept[1:])
+    return LayerGeometry(geom.m_kind, geom.m_params, geom.m_extrusion, kept[geom.m_voffsets], verts[keep], geom.m_handle), removed
+
+def ezpoolContext():
+    # spawn context whose workers run a plain Python interpreter. Inside
+    # FreeCAD sys.executable is FreeCAD itself, use its bundled python.
+    ctx = multiprocessing.get_context("spawn")
+    exe = sys.executable
+    if "python" not in os.path.basename(exe).lower():
+        for name in ("python.exe", "python3", "python"):
+            candidate = os.path.join(os.path.dirname(exe), name)
+            if os.path.exists(candidate):
+                ctx.set_executable(candidate)
+                break
+    return ctx
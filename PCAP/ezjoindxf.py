@@ -0,0 +1,327 @@
+import os
+import sys
+import argparse
+import numpy as np
+import ezdxf
+from ezdxf.math import Vec2
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+import ezread
+import ezprofile
+from ezgeom import EntityIndex, LayerGeometry, ezJoinGeometry, ezdedupeGeometry, ezmergeLines, ezsimplifyPolylines, ezpoolContext, ezpackEntity
+from ezblocks import BlockTemplate, BlockLinks, ezclosedPolyline, ezoblongPolyline, ezassembleGeometry, PIECE, FINISHED
+
+# The ezdxf-only half of ezprocessdxf: collect the entities of the selected
+# layers, explode blocks and join them into one LayerGeometry per layer,
+# which ezlib draws and the command line writes to a DXF. Nothing
+# here imports FreeCAD, so it loads fast in worker processes and runs from
+# the command line to preprocess files:
+#   python PCAP/ezjoindxf.py in.dxf -l LAYER [-l LAYER ...] [--tol 1e-3]
+#       [--engine greedy|graph] [--snap] [--dedupe] [--merge] [--simplify 1e-3]
+#       [--parallel] [--links] [-o out.dxf]
+
+def ezcollectLayer(layer_ents, l, profile=None, templates=None, links=None):
+    # Returns (pieces, finished) LayerGeometry of layer l: the open LINE, ARC
+    # and LWPOLYLINE pieces to join, and the circles and closed polylines
+    # that need no join. templates caches a BlockTemplate per block name.
+    # With a links dict the INSERTs a template accepts are not exploded,
+    # their matrices go to links as {template: matrices}.
+    begin = time()
+    templates = {} if templates is None else templates
+    batches = {}
+    entities = []
+    handles = []
+    finished = []
+    inserts = 0
+    exploded = 0.0
+    for e in layer_ents:
+        if e.dxftype() == 'CIRCLE':
+            finished.append(ezpackEntity(e))
+        
+        elif e.dxftype() == 'LINE':
+            # start and end not coincident
+            if hash(e.dxf.start) != hash(e.dxf.end):
+                entities.append(ezpackEntity(e))
+                handles.append(e.dxf.handle)
+
+        elif e.dxftype() == 'ARC':
+            entities.append(ezpackEntity(e))
+            handles.append(e.dxf.handle)
+
+        elif e.dxftype() == 'LWPOLYLINE':
+            points = e.get_points('xy')
+            if e.is_closed or Vec2(points[0]).isclose(Vec2(points[-1])):
+                if all([hash(pt) == hash(points[0]) for pt in points[1::]]): #exclude point polyline
+                    pass
+                else:
+                    e.close(True)
+                    finished.append(ezpackEntity(e))
+            else:
+                entities.append(ezpackEntity(e))
+                handles.append(e.dxf.handle)
+
+        elif e.dxftype() == 'INSERT':
+            start = time()
+            ezexplodeInsert(e, l, entities, finished, templates, batches)
+            # exploded pieces are virtual entities without a handle
+            handles.extend([None] * (len(entities) - len(handles)))
+            inserts += 1
+            exploded += time() - start
+
+        else:
+            pass
+
+    if links is not None:
+        links.update(batches)
+        batches = {}
+
+    # Instance the INSERTs of each block in one step
+    start = time()
+    built = {template: template.instances(matrices) for template, matrices in batches.items()}
+    exploded += time() - start
+    geom = ezassembleGeometry(entities, built, PIECE, [int(h or "0", 16) for h in handles])
+    done = ezassembleGeometry(finished, built, FINISHED)
+    if profile:
+        # Block explosion is its own stage
+        profile.add("collect", l, time() - begin - exploded, len(geom) + len(done))
+        if inserts:
+            profile.add("explode", l, exploded, inserts)
+    return geom, done
+
+def ezexplodeInsert(e, l, entities, finished, templates=None, batches=None):
+    # Block reference e on layer l: OBLONG blocks become one closed
+    # polyline, other blocks are broken into their entities. Raws of pieces
+    # to join go to entities, raws of closed shapes to finished.
+    # With templates ({block name: BlockTemplate}) and batches ({template:
+    # matrices}) the block is exploded once, the INSERT matrix goes to
+    # batches and a (template, k) marker of instance k to both lists.
+    oblong = 'OBLONG' in e.dxf.name.upper()
+    if templates is not None and batches is not None:
+        template = templates.get(e.dxf.name)
+        if template is None:
+            block = e.block()
+            if block is not None:
+                template = templates[e.dxf.name] = BlockTemplate(block, oblong)
+        m = e.matrix44()
+        if template is not None and template.accepts(m):
+            matrices = batches.setdefault(template, [])
+            entities.append((template, len(matrices)))
+            finished.append((template, len(matrices)))
+            matrices.append(list(m))
+            return
+
+    if oblong:
+        # Get C1, C2, R
+        find_R = False
+        for be in e.virtual_entities():
+            if be.is_closed: # a circle in lwpolyline
+                if find_R:
+                    continue
+                V1 = Vec2(be.get_points('xy')[0])
+                V2 = Vec2(be.get_points('xy')[1])
+                R = V1.distance(V2) # since polyline width is the same as diameter
+                find_R = True
+            else: # a line in lwpolyline 
+                C1 = Vec2(be.get_points('xy')[0])
+                C2 = Vec2(be.get_points('xy')[1])
+        finished.append(ezoblongPolyline(C1, C2, R))
+        return
+
+    # break the block to entities
+    for be in e.virtual_entities():
+        be.dxf.layer=l # set every be in layer l
+        if be.dxftype() == 'CIRCLE':
+            finished.append(ezpackEntity(be))
+        
+        elif be.dxftype() == 'LINE':
+            entities.append(ezpackEntity(be))
+
+        elif be.dxftype() == 'ARC':
+            entities.append(ezpackEntity(be))
+
+        elif be.dxftype() == 'LWPOLYLINE':
+            points = be.get_points('xy')
+            if be.is_closed or Vec2(points[0]).isclose(Vec2(points[-1])):
+                if all([hash(pt) == hash(points[0]) for pt in points[1::]]): #exclude point polyline
+                    pass
+                else:
+                    be.close(True)
+                    finished.append(ezpackEntity(be))
+            else:
+                entities.append(ezpackEntity(be))
+        elif be.dxftype() == 'SOLID':
+            finished.append(ezclosedPolyline(be.vertices()))
+
+def ezjoinBlock(template, tol=None, engine="greedy", snap=False, dedupe=False, merge=False, simplify=0.0):
+    # LayerGeometry of a block in block coordinates, its pieces joined
+    # among themselves
+    geom, route = template.instances([np.eye(4).ravel()])
+    pieces = geom.take(np.flatnonzero(route == PIECE))
+    done = geom.take(np.flatnonzero(route == FINISHED))
+    if dedupe:
+        pieces, removed = ezdedupeGeometry(pieces)
+        done, removed = ezdedupeGeometry(done)
+    if merge:
+        pieces, removed = ezmergeLines(pieces)
+    joined = ezJoinGeometry(pieces, tol, engine=engine, snap=snap)
+    geom = LayerGeometry.concat([done, joined])
+    return ezsimplifyPolylines(geom, simplify)[0]
+
+def ezjoinLayers(dxfdoc, layers, tol=None, engine="greedy", snap=False, dedupe=False, parallel=False, workers=0, profile=None, log=print,
+                 links=None, merge=False, simplify=0.0):
+    # Join layers of dxfdoc, returns {layer: LayerGeometry} holding the
+    # finished shapes followed by the joined chains. dedupe drops repeated
+    # pieces and finished shapes and merge the collinear LINE pieces that
+    # overlap or touch before the join. simplify is the chord tolerance of
+    # the polyline simplification after the join, 0 for none. log prints
+    # the progress lines.
+    # With a links dict, INSERTs are kept as block references where a
+    # template can stand in for them: each block is joined once on its own
+    # and links gets a BlockLinks per layer.
+    profile = profile or ezprofile.StageProfile()
+    if not layers:
+        return {}
+
+    # One pass over modelspace buckets the entities of the selected layers
+    start = time()
+    dxfindex = EntityIndex(dxfdoc.modelspace(), layers)
+    profile.add("bucket", None, time() - start, dxfindex.m_touched)
+    log("Bucketed {} modelspace entities in one pass".format(dxfindex.m_touched))
+
+    # deal with entities, every block is exploded once for all layers
+    layer_geometry = []
+    finished = []
+    templates = {}
+    blocks = {}
+    for l in layers:
+        linked = {} if links is not None else None
+        geom, done = ezcollectLayer(dxfindex.layer(l), l, profile, templates, linked)
+        if links is not None:
+            start = time()
+            links[l] = BlockLinks()
+            for template, matrices in linked.items():
+                if template not in blocks:
+                    blocks[template] = ezjoinBlock(template, tol, engine, snap, dedupe, merge, simplify)
+                links[l].add(template.m_name, blocks[template], matrices)
+            profile.add("blocks", l, time() - start, len(links[l]))
+            log("Layer {} : {} INSERTs of {} blocks linked".format(l, len(links[l]), len(linked)))
+        if dedupe:
+            start = time()
+            geom, removed = ezdedupeGeometry(geom)
+            done, closed = ezdedupeGeometry(done)
+            removed += closed
+            profile.add("dedupe", l, time() - start, removed)
+            log("Layer {} : {} duplicates removed".format(l, removed))
+        if merge:
+            start = time()
+            before = len(geom)
+            geom, removed = ezmergeLines(geom)
+            profile.add("merge", l, time() - start, removed)
+            log("Layer {} : {} collinear LINEs merged, {} -> {} pieces".format(l, removed, before, len(geom)))
+        log("Layer {} : {} entities to join in {} bytes".format(l, len(geom), geom.nbytes))
+        layer_geometry.append(geom)
+        finished.append(done)
+
+    results = {}
+    if parallel and len(layers) > 1:
+        # Join the layers in a process pool, the workers get the geometry arrays
+        start = time()
+        with ProcessPoolExecutor(max_workers=workers or None, mp_context=ezpoolContext()) as pool:
+            futures = [pool.submit(ezJoinGeometry, geom, tol, "grid", engine, snap) for geom in layer_geometry]
+            for l, done, future in zip(layers, finished, futures):
+                results[l] = LayerGeometry.concat([done, future.result()])
+        # The workers run side by side, the pool is timed as a whole
+        profile.add("join", None, time() - start, sum(len(geom) for geom in layer_geometry))
+    else:
+        for l, geom, done in zip(layers, layer_geometry, finished):
+            log("Processing with Layer : {}".format(l))
+            start = time()
+            joined = ezJoinGeometry(geom, tol, engine=engine, snap=snap)
+            profile.add("join", l, time() - start, len(geom))
+            results[l] = LayerGeometry.concat([done, joined])
+
+    if simplify:
+        for l in layers:
+            start = time()
+            geom, removed = ezsimplifyPolylines(results[l], simplify)
+            profile.add("simplify", l, time() - start, removed)
+            log("Layer {} : {} polyline vertexes dropped, {} -> {}".format(l, removed, len(results[l].m_verts), len(geom.m_verts)))
+            results[l] = geom
+    return results
+
+def ezwriteLayers(results, colors, file_path, profile=None, links=None):
+    # Save {layer: LayerGeometry} as a DXF, colors is {layer: ACI color}.
+    # links is {layer: BlockLinks}, written as blocks and INSERTs.
+    profile = profile or ezprofile.StageProfile()
+    doc = ezdxf.new()
+    msp = doc.modelspace()
+    for l, geom in results.items():
+        if doc.layers.has_entry(l):
+            doc.layers.get(l).color = colors[l]
+        else:
+            doc.layers.add(name=l, color=colors[l])
+        start = time()
+        geom.addTo(msp, {"layer": l})
+        if links and l in links:
+            links[l].addTo(doc, msp, {"layer": l})
+        profile.add("write", l, time() - start, len(geom))
+    start = time()
+    doc.saveas(file_path)
+    profile.add("save", None, time() - start, len(msp))
+    return profile
+
+def ezjoinDxf(file_path, layers, out_path, tol=None, engine="greedy", snap=False, dedupe=False, parallel=False, workers=0, log=print,
+              links=False, merge=False, simplify=0.0):
+    # Read layers of file_path, join them and save the joined layers as
+    # out_path. links keeps block references as INSERTs of joined blocks.
+    # Returns the StageProfile of the run.
+    profile = ezprofile.StageProfile(file_path)
+    start = time()
+    dxfdoc = ezread.ezreadLayers(file_path, layers)
+    profile.add("read", None, time() - start, len(dxfdoc.modelspace()))
+    missing = [l for l in layers if not dxfdoc.layers.has_entry(l)]
+    if missing:
+        raise ValueError("{}: no layer {}".format(file_path, ", ".join(missing)))
+
+    blockLinks = {} if links else None
+    results = ezjoinLayers(dxfdoc, layers, tol, engine, snap, dedupe, parallel, workers, profile, log, blockLinks, merge, simplify)
+    colors = {l: abs(dxfdoc.layers.get(l).dxf.color) for l in layers}
+    ezwriteLayers(results, colors, out_path, profile, blockLinks)
+    return profile
+
+def ezjoinedPath(file_path):
+    # <drawing>.joined.dxf next to the DXF
+    return os.path.splitext(file_path)[0] + ".joined.dxf"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Join the open outlines of DXF layers without FreeCAD")
+    parser.add_argument("dxf")
+    parser.add_argument("-l", "--layer", action="append", dest="layers", help="layer to join, repeat for more, all layers when left out")
+    parser.add_argument("-o", "--output", help="joined DXF, <dxf>.joined.dxf by default")
+    parser.add_argument("--tol", type=float, default=0.0, help="endpoint tolerance, 0 for ezdxf isclose")
+    parser.add_argument("--engine", choices=["greedy", "graph"], default="greedy")
+    parser.add_argument("--snap", action="store_true", help="snap endpoints within --tol before joining")
+    parser.add_argument("--dedupe", action="store_true", help="drop repeated LINE, ARC and LWPOLYLINE pieces before joining")
+    parser.add_argument("--merge", action="store_true", help="merge collinear LINE pieces that overlap or touch before joining")
+    parser.add_argument("--simplify", type=float, default=0.0, help="chord tolerance to drop straight polyline vertexes within, 0 for none")
+    parser.add_argument("--parallel", action="store_true", help="join the layers in a process pool")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--links", action="store_true", help="keep block references as INSERTs of the joined blocks")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    layers = args.layers or ezread.ezreadLayerNames(args.dxf)
+    log = (lambda text: None) if args.quiet else (lambda text: print(text, flush=True))
+    out_path = args.output or ezjoinedPath(args.dxf)
+    try:
+        profile = ezjoinDxf(args.dxf, layers, out_path, args.tol or None, args.engine, args.snap, args.dedupe, args.parallel, args.workers, log,
+                            args.links, args.merge, args.simplify)
+    except (OSError, ValueError, ezdxf.DXFError) as err:
+        print("error: {}".format(err), file=sys.stderr)
+        return 1
+    log(profile.reportText())
+    print(out_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
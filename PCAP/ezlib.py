@@ -1,487 +1,190 @@
+import os
 import math
+import numpy as np
 import ezdxf
-from ezdxf.math import Vec2
-from ezdxf.math import BoundingBox2d
-from ezdxf.math import arc_angle_span_deg
 import FreeCAD
 import FreeCADGui
 import Draft
 import Part
 import importDXF
 import DraftVecUtils
-import DraftGeomUtils
 from FreeCAD import Console as FCC
 from time import time
-from enum import Enum
-
-class BVHBuildNode:
+from functools import lru_cache
+import ezread
+import ezcache
+import ezprofile
+from ezjoindxf import ezjoinLayers, ezjoinedPath
+
+class ImportSession:
+    # Join results and FreeCAD objects of the layers drawn from one DXF file.
+    # Kept by the caller between runs, so a new layer selection only joins
+    # and draws the added layers and removes the objects of dropped layers.
     def __init__(self):
-        self.left = None
-        self.right = None
-        self.object = None
-        self.bounds = BoundingBox2d()
-
-class BVHAccel:
-    class splitMethod(Enum):
-        NAIVE = 0
-        SAH = 1
-
-    def __init__(self, ents, splitMethod = splitMethod.NAIVE):
-        self.m_ents = ents
-        #self.m_maxPrimsInNode = maxPrimsInNode
-        self.m_splitMethod = splitMethod.NAIVE
-        start = time()
-        if len(self.m_ents) == 0:
-            return None
-
-        self.root = self._recursiveBuild(self.m_ents)
-        stop = time()
-        print("BVH Generation complete: \nTime Taken: {} secs".format(stop-start))
-
-    def findNextEntity(self, entity_list):
-        # For Next Entity, consider entity_list[-1]
-        myEnt = entity_list[-1]
-        node = self.root
-        return self.getNextEntity(node, myEnt)
-    
-    def getNextEntity(self, node, myEnt):
-        # check myEnt reverse: st, end
-        if myEnt.reverse == False:
-            st,end = 0,-1
-        else:
-            st,end = -1,0
-
-        # Leaf node
-        if node.object != None:
-            # Find itself
-            if node.object == myEnt:
-                return None
-
-            # end connect start
-            if node.object.Vertexes[0].isclose(myEnt.Vertexes[end]) and not node.object.joined:
-                if node.object.Vertexes[-1].isclose(myEnt.Vertexes[st]): #if myEnt start connect find_ent end
-                    # To exclude the conditon that e1 and e2 are essentially lines
-                    e1 = node.object.m_entity
-                    e2 = myEnt.m_entity
-                    if e1.dxftype() == "LINE" and e2.dxftype() == "LINE":
-                        return None
-                    if e1.dxftype() == "LWPOLYLINE" and e2.dxftype() == "LWPOLYLINE": 
-                        if all([v[4]==0.0 for v in e1.get_points()]) and all([v[4]==0.0 for v in e2.get_points()]): #e1 and e2 all vertexes value equal 0.0 -> line
-                            return None
-                return node.object
-            
-            # end connect end
-            elif node.object.Vertexes[-1].isclose(myEnt.Vertexes[end]) and not node.object.joined:
-                if node.object.Vertexes[0].isclose(myEnt.Vertexes[st]): #if myEnt start connect find_ent start
-                    # To exclude the conditon that e1 and e2 are essentially lines
-                    e1 = node.object.m_entity
-                    e2 = myEnt.m_entity
-                    if e1.dxftype() == "LINE" and e2.dxftype() == "LINE":
-                        return None
-                    if e1.dxftype() == "LWPOLYLINE" and e2.dxftype() == "LWPOLYLINE": 
-                        if all([v[4]==0.0 for v in e1.get_points()]) and all([v[4]==0.0 for v in e2.get_points()]): #e1 and e2 all vertexes value equal 0.0 -> line
-                            return None
-                node.object.reverse = True
-                return node.object
-
-            else:
-                return None
-
-        # Try myEnt end_point
-        point_in_left = node.left.bounds.inside(myEnt.Vertexes[end])
-        point_in_right = node.right.bounds.inside(myEnt.Vertexes[end])
-        if point_in_left and not point_in_right:
-            return self.getNextEntity(node.left, myEnt)
-        elif point_in_right and not point_in_left:
-            return self.getNextEntity(node.right, myEnt)
-        elif point_in_left and point_in_right:
-            if node.left.bounds.inside(myEnt.Vertexes[st]): # myEnt start_point in node.left
-                return self.getNextEntity(node.left, myEnt) or self.getNextEntity(node.right, myEnt)
-            else:
-                return self.getNextEntity(node.right, myEnt) or self.getNextEntity(node.left, myEnt)
-
-        return None
-
-    def findPreviousEntity(self, reversed_polys):
-        # For Previous Entity
-        myEnt = reversed_polys[-1]
-        node = self.root
-        return self.getPreviousEntity(node, myEnt)
-    
-    def getPreviousEntity(self, node, myEnt):
-        # check myEnt reverse: st, end 
-        if myEnt.reverse == False:
-            st,end = 0,-1
-        else:
-            st,end = -1,0
-
-        # Leaf node
-        if node.object != None:
-            # Find itself
-            if node.object == myEnt:
-                return None
-
-            # end connect start
-            if node.object.Vertexes[-1].isclose(myEnt.Vertexes[st]) and not node.object.joined:
-                if node.object.Vertexes[0].isclose(myEnt.Vertexes[end]): #if myEnt end connect find_ent start
-                    # To exclude the conditon that e1 and e2 are essentially lines
-                    e1 = node.object.m_entity
-                    e2 = myEnt.m_entity
-                    if e1.dxftype() == "LINE" and e2.dxftype() == "LINE":
-                        return None
-                    if e1.dxftype() == "LWPOLYLINE" and e2.dxftype() == "LWPOLYLINE": 
-                        if all([v[4]==0.0 for v in e1.get_points()]) and all([v[4]==0.0 for v in e2.get_points()]): #e1 and e2 all vertexes value equal 0.0 -> line
-                            return None
-                return node.object
-            
-            # start connect start
-            elif node.object.Vertexes[0].isclose(myEnt.Vertexes[st]) and not node.object.joined:
-                if node.object.Vertexes[-1].isclose(myEnt.Vertexes[end]): #if myEnt end connect find_ent end
-                    # To exclude the conditon that e1 and e2 are essentially lines
-                    e1 = node.object.m_entity
-                    e2 = myEnt.m_entity
-                    if e1.dxftype() == "LINE" and e2.dxftype() == "LINE":
-                        return None
-                    if e1.dxftype() == "LWPOLYLINE" and e2.dxftype() == "LWPOLYLINE": 
-                        if all([v[4]==0.0 for v in e1.get_points()]) and all([v[4]==0.0 for v in e2.get_points()]): #e1 and e2 all vertexes value equal 0.0 -> line
-                            return None
-                node.object.reverse = True
-                return node.object
-
-            else:
-                return None
-
-        # Try myEnt start_point
-        point_in_left = node.left.bounds.inside(myEnt.Vertexes[st])
-        point_in_right = node.right.bounds.inside(myEnt.Vertexes[st])
-        if point_in_left and not point_in_right:
-            return self.getPreviousEntity(node.left, myEnt)
-        elif point_in_right and not point_in_left:
-            return self.getPreviousEntity(node.right, myEnt)
-        elif point_in_left and point_in_right:
-            if node.left.bounds.inside(myEnt.Vertexes[end]): # myEnt end_point in node.left
-                return self.getPreviousEntity(node.left, myEnt) or self.getPreviousEntity(node.right, myEnt)
-            else:
-                return self.getPreviousEntity(node.right, myEnt) or self.getPreviousEntity(node.left, myEnt)
-
-        return None
-    
-    def _recursiveBuild(self, ents):
-        node = BVHBuildNode()
-        #bounds = BoundingBox2d()
-        if (len(ents) == 1):
-            node.bounds = ents[0].get_bounds()
-            #node.object = ents[0].m_entity
-            node.object = ents[0]
-            node.left = None
-            node.right = None
-            return node
-
-        elif (len(ents) == 2):
-            node.left = self._recursiveBuild([ents[0]])
-            node.right = self._recursiveBuild([ents[1]])
-            node.bounds = node.left.bounds.union(node.right.bounds)
-            return node
-        
-        else:
-            centroidBounds = BoundingBox2d()
-            for i in range(len(ents)):
-                centroidBounds.extend([Centroid(ents[i].get_bounds())])
-            dim = maxExtent(centroidBounds)
-            if dim == 0:
-                sorted_ents = sorted(ents, key=lambda ent: Centroid(ent.get_bounds()).x)
-            elif dim == 1:
-                sorted_ents = sorted(ents, key=lambda ent: Centroid(ent.get_bounds()).y)
-            
-            median = int((len(sorted_ents)+1)/2)
-
-            leftentities = sorted_ents[0:median]
-            rightentities = sorted_ents[median:]
-            node.left = self._recursiveBuild(leftentities)
-            node.right = self._recursiveBuild(rightentities)
-
-            node.bounds = node.left.bounds.union(node.right.bounds)
-
-        return node
-
-def ezJoinPolys(entities): 
-    bvh = BVHAccel(entities)
-    sorted_polys = []
-    total = len(entities)
-    for i in range(total):
-        if entities[i].joined:
-            continue
-
-        poly_is_closed = False
-        polys = []
-        polys.append(entities[i])
-        entities[i].joined = True
-        nextEntity = bvh.findNextEntity(polys)
-        while nextEntity != None and (not nextEntity.joined):
-            # Check if nextEntity and polys[0] form closed polyline
-            if not nextEntity.reverse:
-                end = -1
-            else:
-                end = 0
-
-            if (len(polys) == 1):
-                e0 = polys[0].m_entity
-                if e0.dxftype() in ['ARC', 'LWPOLYLINE']:
-                    if e0.dxftype() == 'ARC':
-                        z_orient = e0.dxf.extrusion.z
-                        z_orient /= abs(z_orient)
-                        b0 = z_orient * ezgetBulge(e0)
-                    else:
-                        b0 = e0.get_points()[-2][4]
-
-                    checkEntity = nextEntity
-                    v1 = polys[0].Vertexes[1] - polys[0].Vertexes[0]
-                    v2 = checkEntity.Vertexes[end] - polys[0].Vertexes[1]  
-                    
-                    if b0 != 0.0 and b0 * (v1.x * v2.y - v1.y * v2.x) <= 0: # Different side with the bulge
-                        checkEntity.joined = True # Temporary!!
-                        nextEntity = bvh.findNextEntity(polys)
-                        if nextEntity and not nextEntity.joined: # Find newEntity
-                            checkEntity.joined = False # Return to False
-                            checkEntity.reverse = False # Return to default!!
-                            if nextEntity.reverse == False:
-                                end = -1
-                            else:
-                                end = 0
-                        else:
-                            nextEntity = checkEntity # Did not find
-            else:
-                checkEntity = nextEntity
-                pl1 = polys[-2] 
-                if pl1.reverse:
-                    pl1st = -1
-                else:
-                    pl1st = 0
-                pl2 = polys[-1]
-                # Check if nextEntity is on the same side with pl1 and pl2
-                # find linear equation for pl2 : y = (y1 - y0) / (x1 - x0) * (x - x0) + y0
-                V1 = pl2.Vertexes[0] #Vec2
-                V2 = pl2.Vertexes[1] #Vec2
-                if V1.x == V2.x: # Vertical line, x = const 
-                    if (pl1.Vertexes[pl1st].x- V1.x) * (checkEntity.Vertexes[end].x - V1.x) <= 0: # pl1 start point is on the different side with checkEntity end point
-                        checkEntity.joined = True # Temporary!!
-                        nextEntity = bvh.findNextEntity(polys)
-                        if nextEntity and not nextEntity.joined: # Find newEntity
-                            checkEntity.joined = False # Return to False
-                            checkEntity.reverse = False # Return to default!!
-                            if nextEntity.reverse == False:
-                                end = -1
-                            else:
-                                end = 0
-                        else:
-                            nextEntity = checkEntity # Did not find
-                else:
-                    m = (V2.y - V1.y) / (V2.x - V1.x)
-                    if (pl1.Vertexes[pl1st].y - (m * (pl1.Vertexes[pl1st].x- V1.x) + V1.y)) * (checkEntity.Vertexes[end].y - (m * (checkEntity.Vertexes[end].x- V1.x) + V1.y)) <= 0:
-                        checkEntity.joined = True # Temporary!!
-                        nextEntity = bvh.findNextEntity(polys)
-                        if nextEntity and not nextEntity.joined: # Find newEntity
-                            checkEntity.joined = False # Return to False
-                            checkEntity.reverse = False # Return to default!!
-                            if nextEntity.reverse == False:
-                                end = -1
-                            else:
-                                end = 0
-                        else:
-                            nextEntity = checkEntity # Did not find
-
-            if nextEntity.Vertexes[end].isclose(polys[0].Vertexes[0]):
-                polys.append(nextEntity)
-                nextEntity.joined = True
-                poly_is_closed = True
-                break
-
-            # Join nextEntity
-            polys.append(nextEntity)
-            nextEntity.joined = True
-
-            # find nextEntity
-            nextEntity = bvh.findNextEntity(polys)
-        
-        if (not poly_is_closed):
-            reverse_polys = []
-            # Use polys[0] to find previousEntity
-            previousEntity = bvh.findPreviousEntity([polys[0]])
-
-            while previousEntity != None and (not previousEntity.joined):
-                # Join previousEntity
-                reverse_polys.append(previousEntity)
-                previousEntity.joined = True
-
-                # find previousEntity
-                previousEntity = bvh.findPreviousEntity(reverse_polys)
-
-            polys = reverse_polys[::-1] + polys
-
-        sorted_polys.append(polys)
-        #print("\rProgressing : {}%".format(int(100*(i+1)/total)), end='', flush=True)  
-    #print("\n", end='', flush=True)  
-    return sorted_polys
-
-
-def Centroid(bbox):
-    # UVec
-    return 0.5*(bbox.extmin + bbox.extmax)
-
-def maxExtent(bbox):
-    d = bbox.extmax- bbox.extmin
-    if (d.x > d.y):
-        return 0
-    else:
-        return 1
-
-class myEntity:
-    def __init__(self, entity):
-        self.m_entity = entity
-        self.reverse = False
-        self.joined = False
-        self.Vertexes = self.getVertexes()
-    
-    def get_bounds(self):
-        #if self.m_entity.dxftype() == 'CIRCLE':
-            #c = self.m_entity.dxf.center
-            #r = self.m_enitty.dxf.radius
-            #return BoundingBox2d([c - Vec2(-r, -r), c + Vec2(r,r)])
-        if self.m_entity.dxftype() == 'LINE':
-            l = self.m_entity
-            return BoundingBox2d([l.dxf.start, l.dxf.end])
-        elif self.m_entity.dxftype() == 'ARC':
-            arc = self.m_entity
-            return BoundingBox2d([arc.start_point, arc.end_point])
-        elif self.m_entity.dxftype() == 'LWPOLYLINE':
-            pl = self.m_entity
-            bbox = BoundingBox2d()
-            bbox.extend(pl.vertices())
-            return bbox
-
-    def getVertexes(self):
-        if self.m_entity.dxftype() == 'LINE':
-            l = self.m_entity
-            return [l.dxf.start, l.dxf.end]
-        elif self.m_entity.dxftype() == 'ARC':
-            arc = self.m_entity
-            return [arc.start_point, arc.end_point]
-        elif self.m_entity.dxftype() == 'LWPOLYLINE':
-            pl = self.m_entity
-            return [Vec2(pl.get_points('xy')[0]), Vec2(pl.get_points('xy')[-1])]
-
-def ezprocessdxf(dxfdoc, sel_layer, mydoc=None):
+        self.m_resultKey = None
+        self.m_drawKey = None
+        self.m_results = {}      # layer -> (color, LayerGeometry, BlockLinks or None)
+        self.m_objects = {}      # layer -> names of the drawn objects
+        self.m_layerObjects = {} # layer -> name of the FreeCAD layer
+
+    def begin(self, mydoc, file_path, joinKey=()):
+        # Forget what no longer matches the file, join settings, document or
+        # drawing preferences
+        stamp = None
+        if file_path:
+            st = os.stat(file_path)
+            stamp = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+        resultKey = (stamp, joinKey)
+        if resultKey != self.m_resultKey:
+            self.m_resultKey = resultKey
+            self.m_results = {}
+        drawKey = (mydoc.Name, resultKey, dxfCreateDraft, dxfCreateSketch, dxfRenderPolylineWidth,
+                   dxfFillMode, dxfUseDraftVisGroups, dxfScaling, pcapBatchObjects)
+        if drawKey != self.m_drawKey:
+            # The objects drawn with the old key would stay next to the
+            # redrawn ones, objects in another document are left alone
+            if self.m_drawKey and self.m_drawKey[0] == mydoc.Name:
+                for l in self.drawnLayers():
+                    self.removeLayer(mydoc, l)
+            self.m_drawKey = drawKey
+            self.m_objects = {}
+            self.m_layerObjects = {}
+
+    def isDrawn(self, mydoc, l):
+        # False as well when the user deleted some of the layer's objects
+        if l not in self.m_objects:
+            return False
+        names = self.m_objects[l] + [self.m_layerObjects[l]]
+        return all(mydoc.getObject(name) is not None for name in names)
+
+    def addLayer(self, l, result, objects, layer):
+        self.m_results[l] = result
+        self.m_objects[l] = [ob.Name for ob in objects]
+        self.m_layerObjects[l] = layer.Name
+
+    def removeLayer(self, mydoc, l):
+        for name in self.m_objects.pop(l, []) + [self.m_layerObjects.pop(l, None)]:
+            if name and mydoc.getObject(name) is not None:
+                mydoc.removeObject(name)
+
+    def drawnLayers(self):
+        return list(self.m_objects)
+
+# LayerCache kept between runs, its fileHash memo spares hashing the same
+# file again
+layerCache = None
+
+def ezlayerCache():
+    global layerCache
+    cacheDir = os.path.join(FreeCAD.getUserAppDataDir(), "PCAPCache")
+    maxBytes = pcapLayerCacheMB * 2**20
+    if layerCache is None or (layerCache.m_dir, layerCache.m_maxBytes) != (cacheDir, maxBytes):
+        layerCache = ezcache.LayerCache(cacheDir, maxBytes)
+    return layerCache
+
+def ezprocessdxf(dxfdoc, sel_layer, mydoc=None, file_path=None, session=None, batchObjects=None):
+    # dxfdoc may be None, the selected layers are then streamed from file_path.
+    # With a session only the layers not drawn by the previous runs are processed.
+    # batchObjects overrides pcapBatchObjects, False when the caller needs
+    # one feature per shape.
     FCC.PrintMessage("mydoc : " + mydoc.Name + "\n")
+    profile = ezprofile.StageProfile(file_path)
     ezreadPreferences()
-    dxfmsp = dxfdoc.modelspace()
+    if batchObjects is not None:
+        global pcapBatchObjects
+        pcapBatchObjects = batchObjects
+    tol = pcapJoinTolerance or None
+    # Draft objects do not go into the compound of a linked block
+    linkBlocks = pcapLinkBlocks and not (dxfCreateDraft or dxfCreateSketch)
+    # Everything that changes the join result of a layer
+    joinKey = (tol, pcapJoinEngine, pcapSnapEndpoints, pcapDedupe, linkBlocks, pcapMergeLines, pcapSimplifyTolerance)
+
+    # FreeCAD layers by label
+    global layers
+    layers = {}
+
+    cached = {}
+    if session:
+        session.begin(mydoc, file_path, joinKey)
+        for l in session.drawnLayers():
+            if l not in sel_layer or not session.isDrawn(mydoc, l):
+                session.removeLayer(mydoc, l)
+        kept = session.drawnLayers()
+        sel_layer = [l for l in sel_layer if l not in kept]
+        FCC.PrintMessage("Session keeps {} layers, {} to draw\n".format(len(kept), len(sel_layer)))
+        # Layers joined by an earlier run are only redrawn
+        for l in sel_layer:
+            if l in session.m_results:
+                cached[l] = session.m_results[l]
+
+    # Layers already processed for this file content come from the cache
+    cache = None
+    if pcapLayerCache and file_path:
+        start = time()
+        cache = ezlayerCache()
+        fileHash = cache.fileHash(file_path)
+        for l in sel_layer:
+            if l in cached:
+                continue
+            hit = cache.get(fileHash, l, joinKey)
+            if hit:
+                cached[l] = hit
+        profile.add("cache", None, time() - start)
+    todo = [l for l in sel_layer if l not in cached]
+
+    if dxfdoc is None and todo:
+        start = time()
+        dxfdoc = ezread.ezreadLayers(file_path, todo)
+        profile.add("read", None, time() - start, len(dxfdoc.modelspace()))
 
+    # tmpdoc holds the layer table, its modelspace is only filled to export
+    # the joined geometry
     tmpdoc = ezdxf.new()
     tmpmsp = tmpdoc.modelspace()
-    
-    # FreeCAD layers
-    global layers
-    layers = []
 
-    # copy sel_layer to tmpdoc and deal with entities
     for l in sel_layer:
-        tmpdoc.layers.add(name=l, color=abs(dxfdoc.layers.get(l).dxf.color))
-
-        # deal with entities
-        entities = []
-        for e in dxfmsp.query('*[layer=="' + l + '"]'):
-            if e.dxftype() == 'CIRCLE':
-                tmpmsp.add_foreign_entity(e)
-            
-            elif e.dxftype() == 'LINE':
-                # start and end not coincident
-                if hash(e.dxf.start) != hash(e.dxf.end):
-                    entity = myEntity(e)
-                    entities.append(entity)
-
-            elif e.dxftype() == 'ARC':
-                entity = myEntity(e)
-                entities.append(entity)
-
-            elif e.dxftype() == 'LWPOLYLINE':
-                if e.is_closed or Vec2(e.get_points('xy')[0]).isclose(Vec2(e.get_points('xy')[-1])):
-                    if all([hash(pt) == hash(e.get_points('xy')[0]) for pt in e.get_points('xy')[1::]]): #exclude point polyline
-                        pass
-                    else:
-                        e.close(True)
-                        tmpmsp.add_foreign_entity(e)
-                else:
-                    entity = myEntity(e)
-                    entities.append(entity)
-
-            elif e.dxftype() == 'INSERT':
-                if 'OBLONG' in e.dxf.name.upper():
-                    # Get C1, C2, R
-                    find_R = False
-                    for be in e.virtual_entities():
-                        if be.is_closed: # a circle in lwpolyline
-                            if find_R:
-                                continue
-                            V1 = Vec2(be.get_points('xy')[0])
-                            V2 = Vec2(be.get_points('xy')[1])
-                            R = V1.distance(V2) # since polyline width is the same as diameter
-                            find_R = True
-                        else: # a line in lwpolyline 
-                            C1 = Vec2(be.get_points('xy')[0])
-                            C2 = Vec2(be.get_points('xy')[1])
-                    CC = (C1 - C2).normalize()
-                    N = Vec2(-CC.y, CC.x)
-                    ob1 = C1 + R*N
-                    ob2 = C2 + R*N
-                    ob3 = C2 - R*N
-                    ob4 = C1 - R*N
-                    tmpmsp.add_lwpolyline([(ob1.x, ob1.y, 0), (ob2.x, ob2.y, 1), (ob3.x, ob3.y, 0), (ob4.x, ob4.y, 1)], format="xyb", close=True, dxfattribs={"layer": l})
-                    continue
-
-                # break the block to entities
-                for be in e.virtual_entities():
-                    be.dxf.layer=l # set every be in layer l
-                    if be.dxftype() == 'CIRCLE':
-                        tmpmsp.add_foreign_entity(be)
-                    
-                    elif be.dxftype() == 'LINE':
-                        entity = myEntity(be)
-                        entities.append(entity)
-
-                    elif be.dxftype() == 'ARC':
-                        entity = myEntity(be)
-                        entities.append(entity)
-
-                    elif be.dxftype() == 'LWPOLYLINE':
-                        if be.is_closed or Vec2(be.get_points('xy')[0]).isclose(Vec2(be.get_points('xy')[-1])):
-                            if all([hash(pt) == hash(be.get_points('xy')[0]) for pt in be.get_points('xy')[1::]]): #exclude point polyline
-                                pass
-                            else:
-                                be.close(True)
-                                tmpmsp.add_foreign_entity(be)
-                        else:
-                            entity = myEntity(be)
-                            entities.append(entity)
-                    elif be.dxftype() == 'SOLID':
-                        tmpmsp.add_lwpolyline(be.vertices(), close=True, dxfattribs={"layer": l})
-            
-            else:
-                pass
-
-        print("Processing with Layer : {}".format(l), flush=True)
+        if l in cached:
+            tmpdoc.layers.add(name=l, color=cached[l][0])
+        else:
+            tmpdoc.layers.add(name=l, color=abs(dxfdoc.layers.get(l).dxf.color))
+
+    # Collect and join the layers, with linkBlocks the block references
+    # go to blockLinks
+    blockLinks = {} if linkBlocks else None
+    joined = ezjoinLayers(dxfdoc, todo, tol, pcapJoinEngine, pcapSnapEndpoints, pcapDedupe, pcapParallelJoin, pcapJoinWorkers,
+                          profile, lambda text: FCC.PrintMessage(text + "\n"), blockLinks, pcapMergeLines,
+                          pcapSimplifyTolerance)
+
+    # Geometry to draw per layer, joined in this run or earlier
+    results = {}
+    for l in todo:
+        results[l] = (tmpdoc.layers.get(l).color, joined[l], blockLinks[l] if linkBlocks else None)
+    if cache and todo:
         start = time()
-        sorted_entities = ezJoinPolys(entities)
-        stop = time()
-        print("Join polylines complete: \nTime Taken: {} secs".format(stop-start), flush=True)
-
-        # Draw sorted_entities to tmpmsp on layer l
-        for poly in sorted_entities:
-            ezaddEntity(poly, tmpmsp, l)
-
-    #output_path = "C:\\Users\\Tony.dai\\Desktop\\fixture\\new_issue\\DDC需求資料\\loveHuiyu.dxf"
-    #tmpdoc.saveas(output_path)
+        for l in todo:
+            cache.put(fileHash, l, joinKey, *results[l])
+        profile.add("cache", None, time() - start, sum(len(joined[l]) for l in todo))
+    for l in sel_layer:
+        if l in cached:
+            results[l] = cached[l]
+    if cache:
+        FCC.PrintMessage(cache.statsText() + "\n")
+
+    # The joined geometry as <drawing>.joined.dxf, for debugging
+    if pcapExportJoined and file_path:
+        for l in sel_layer:
+            start = time()
+            results[l][1].addTo(tmpmsp, {"layer": l})
+            if results[l][2]:
+                results[l][2].addTo(tmpdoc, tmpmsp, {"layer": l})
+            profile.add("write", l, time() - start, len(results[l][1]))
+        try:
+            tmpdoc.saveas(ezjoinedPath(file_path))
+        except OSError as err:
+            FCC.PrintWarning("Joined DXF not saved: {}\n".format(err))
 
     FreeCADGui.updateGui()
-    # ======= Draw tmpdoc in FreeCAD =======
+    # ======= Draw the layer geometry in FreeCAD =======
     # Obtain the layers in tmpdoc
     ezlayers = []
     for lay_name in sel_layer:
@@ -491,21 +194,27 @@ def ezprocessdxf(dxfdoc, sel_layer, mydoc=None):
     for ezlay in ezlayers: 
         FCC.PrintMessage("Drawing layer : " + ezlay.dxf.name + " in FreeCAD\n")
         FreeCADGui.updateGui()
+        start = time()
+        drawn = []
+        # Part shapes of the layer go into compounds in batch mode
+        batch = [] if pcapBatchObjects else None
 
         # Query for LWPOLYLINE
-        polylines = tmpmsp.query('LWPOLYLINE[layer=="' + ezlay.dxf.name + '"]')
+        geom = results[ezlay.dxf.name][1]
+        polylines = geom.query('LWPOLYLINE')
         if polylines:
             FCC.PrintMessage("---Drawing " + str(len(polylines)) + " polylines...\n")
 
         num = 0
-        for polyline in polylines:
-            shape = ezdrawPolyline(polyline, num)
+        for shape in ezdrawPolylines(polylines):
             if shape:
-                newob = ezaddObject(shape, mydoc, "Polyline", ezlay)
+                newob = ezaddObject(shape, mydoc, "Polyline", ezlay, batch)
+                if newob:
+                    drawn.append(newob)
                 num += 1
 
         # Query for LINE
-        lines = tmpmsp.query('LINE[layer=="' + ezlay.dxf.name + '"]')
+        lines = geom.query('LINE')
         if lines:
             FCC.PrintMessage("---Drawing " + str(len(lines)) + " lines...\n")
 
@@ -513,11 +222,13 @@ def ezprocessdxf(dxfdoc, sel_layer, mydoc=None):
         for line in lines:
             shape = ezdrawLine(line)
             if shape:
-                newob = ezaddObject(shape, mydoc, "Line", ezlay)
+                newob = ezaddObject(shape, mydoc, "Line", ezlay, batch)
+                if newob:
+                    drawn.append(newob)
                 num += 1
 
         # Query for ARC
-        arcs = tmpmsp.query('ARC[layer=="' + ezlay.dxf.name + '"]')
+        arcs = geom.query('ARC')
         if arcs:
             FCC.PrintMessage("---Drawing " + str(len(arcs)) + " arcs...\n")
 
@@ -525,11 +236,13 @@ def ezprocessdxf(dxfdoc, sel_layer, mydoc=None):
         for arc in arcs:
             shape = ezdrawArc(arc)
             if shape:
-                newob = ezaddObject(shape, mydoc, "Arc", ezlay)
+                newob = ezaddObject(shape, mydoc, "Arc", ezlay, batch)
+                if newob:
+                    drawn.append(newob)
                 num += 1
 
         # Query for CIRCLE
-        circles = tmpmsp.query('CIRCLE[layer=="' + ezlay.dxf.name + '"]')
+        circles = geom.query('CIRCLE')
         if circles: 
             FCC.PrintMessage("---Drawing " + str(len(circles)) + " circles...\n")
 
@@ -537,105 +250,44 @@ def ezprocessdxf(dxfdoc, sel_layer, mydoc=None):
         for circle in circles:
             shape = ezdrawCircle(circle)
             if shape:
-                newob = ezaddObject(shape, mydoc, "Circle", ezlay)
+                newob = ezaddObject(shape, mydoc, "Circle", ezlay, batch)
+                if newob:
+                    drawn.append(newob)
                 num += 1
 
-        if not polylines and not lines and not arcs and not circles:
-            lay_color = tuple( i/255 for i in ezdxf.colors.aci2rgb(ezlay.color))
-            lay = ezlocateLayer(ezlay.dxf.name, mydoc, lay_color, "Solid")
+        if batch:
+            drawn.extend(ezaddBatch(batch, mydoc, ezlay))
+
+        # Linked block references
+        links = results[ezlay.dxf.name][2]
+        if links:
+            FCC.PrintMessage("---Linking " + str(len(links)) + " block references...\n")
+            drawn.extend(ezaddLinks(links, mydoc, ezlay))
 
+        lay = ezlocateLayer(ezlay.dxf.name, mydoc, ezlayerColor(ezlay.color), "Solid")
+        if session:
+            session.addLayer(ezlay.dxf.name, results[ezlay.dxf.name], drawn, lay)
+        profile.add("draw", ezlay.dxf.name, time() - start,
+                    len(polylines) + len(lines) + len(arcs) + len(circles) + (len(links) if links else 0))
 
     # Finishing
     print("done processing")
 
+    start = time()
     mydoc.recompute()
+    profile.add("recompute", None, time() - start)
     print("recompute done")
 
+    FCC.PrintMessage(profile.reportText() + "\n")
+    if pcapProfileFile and file_path:
+        try:
+            profile.save(ezprofile.ezprofilePath(file_path))
+        except OSError as err:
+            FCC.PrintWarning("Profile not saved: {}\n".format(err))
+
     FCC.PrintMessage("successfully imported.\n")
     FreeCADGui.updateGui()
 
-def ezaddEntity(ent_list, tmpmsp, l):
-    # Draw one poly at one time
-    if len(ent_list) == 1:
-        e = ent_list[0].m_entity
-        tmpmsp.add_foreign_entity(e)
-    else:
-        vertexes = []
-        line_width = 0
-        set_width = False
-
-        # Add start vertex to vertexes!
-        for myEnt in ent_list:
-            e = myEnt.m_entity
-            if myEnt.reverse == False:
-                start = 0
-            else:
-                start = -1
-
-            if e.dxftype() == 'LINE':
-                vertexes.append((myEnt.Vertexes[start].x, myEnt.Vertexes[start].y))
-
-            elif e.dxftype() == 'ARC':
-                z_orient = e.dxf.extrusion.z
-                z_orient /= abs(z_orient)
-                if myEnt.reverse == False:
-                    vertexes.append((myEnt.Vertexes[start].x, myEnt.Vertexes[start].y,0,0, z_orient * ezgetBulge(e)))
-                else:
-                    vertexes.append((myEnt.Vertexes[start].x, myEnt.Vertexes[start].y,0,0, -z_orient * ezgetBulge(e)))
-
-            elif e.dxftype() == 'LWPOLYLINE':
-                if not set_width:
-                    line_width = e.dxf.const_width
-                    set_width = True
-                if myEnt.reverse == False:
-                    vertexes += e.get_points()[:-1:]
-                else:
-                    pts = e.get_points()
-                    m = len(pts)
-                    rev_pts = [(pts[m-i-1][0], pts[m-i-1][1], pts[m-i-1][3], pts[m-i-1][2], -pts[m-i-2][4]) for i in range(m)]
-                    vertexes += rev_pts[:-1:]
-
-        # Obtain is_poly_closed
-        is_poly_closed = False
-        first_ent = ent_list[0]
-        last_ent = ent_list[-1]
-
-        if first_ent.reverse == False:
-            start = 0
-        else:
-            start = -1
-
-        if last_ent.reverse == False:
-            end = -1
-        else:
-            end = 0
-        
-        if first_ent.Vertexes[start].isclose(last_ent.Vertexes[end]):
-            is_poly_closed = True
-        else:
-            #Add last_end Vertexes[end]
-            vertexes.append((last_ent.Vertexes[end].x, myEnt.Vertexes[end].y))
-
-        tmpmsp.add_lwpolyline(vertexes, close=is_poly_closed, dxfattribs={"layer" : l, "const_width" : line_width,})
-
-def ezgetBulge(arc):
-    span_angle = arc_angle_span_deg(arc.dxf.start_angle, arc.dxf.end_angle)
-    V1 = arc.start_point
-    V2 = arc.end_point
-    center = arc.dxf.center
-    radius = arc.dxf.radius
-    M = (V1 + V2)/2
-    epsilon = 0.0001
-    if span_angle < 180 - epsilon:
-        d = radius * (M - center).normalize()
-    elif abs(span_angle - 180.0) < epsilon:
-            return 1.0
-    else:
-        d = radius * (center - M).normalize()
-    S = center + d
-    return S.distance(M) / V2.distance(M)
-
-
 def ezjoin(shapes): 
     # Join lines, polylines and arcs if needed, where shapes is a list of shape
     if dxfJoin and shapes:
@@ -645,11 +297,76 @@ def ezjoin(shapes):
         edges = []
         for s in shapes:
             edges.extend(s.Edges)
-        shapes = DraftGeomUtils.findWires(edges)
+        shapes = ezfindWires(edges)
         end = time()
-        FCC.PrintMessage("t = {}s\n".format(end- start))
+        FCC.PrintMessage("Joined {} edges into {} wires, t = {}s\n".format(len(edges), len(shapes), end - start))
     return shapes
 
+def ezfindWires(edges):
+    # Group edges connected at their end vertexes into wires, in O(n)
+    # unlike DraftGeomUtils.findWires. Vertexes are hashed on coordinates
+    # rounded to importDXF.prec(). A wire starts at an odd vertex of its
+    # edges when there is one and walks on, each edge oriented from the
+    # vertex it is reached at. Branches follow as trails that start on a
+    # vertex already in the wire.
+    digits = importDXF.prec()
+    key = lambda v: (round(v.Point.x, digits), round(v.Point.y, digits), round(v.Point.z, digits))
+    ends = []
+    at = {}
+    degree = {}
+    for i, e in enumerate(edges):
+        a, b = key(e.Vertexes[0]), key(e.Vertexes[-1])
+        ends.append((a, b))
+        for v in (a, b):
+            degree[v] = degree.get(v, 0) + 1
+        at.setdefault(a, []).append(i)
+        if b != a:
+            at.setdefault(b, []).append(i)
+
+    seen = set()
+    used = [False] * len(edges)
+    nextEdge = dict.fromkeys(at, 0)
+    wires = []
+    for first in range(len(edges)):
+        if ends[first][0] in seen:
+            continue
+        # Vertexes of the connected edges of first, an odd one to start at
+        start = ends[first][0]
+        seen.add(start)
+        stack = [start]
+        while stack:
+            v = stack.pop()
+            if degree[v] % 2 and degree[start] % 2 == 0:
+                start = v
+            for i in at[v]:
+                for w in ends[i]:
+                    if w not in seen:
+                        seen.add(w)
+                        stack.append(w)
+
+        ordered = []
+        pending = [start]
+        while pending:
+            v = pending.pop()
+            while True:
+                rows = at[v]
+                while nextEdge[v] < len(rows) and used[rows[nextEdge[v]]]:
+                    nextEdge[v] += 1
+                if nextEdge[v] == len(rows):
+                    break
+                i = rows[nextEdge[v]]
+                used[i] = True
+                a, b = ends[i]
+                ordered.append(edges[i] if a == v else edges[i].reversed())
+                pending.append(v)
+                v = b if a == v else a
+        try:
+            wires.append(Part.Wire(ordered))
+        except Part.OCCError:
+            # Vertexes equal when rounded but apart for OCC
+            wires.extend(Part.Wire(e) for e in ordered)
+    return wires
+
 def ezvec(pt, z0=None):
     if isinstance(pt, (int, float)):
         v = round(pt, importDXF.prec())
@@ -723,44 +440,140 @@ def ezdrawPolyline(polyline, num=None):
                     except Part.OCCError:
                         pass
                         #importDXF.warn(polyline, num)
-        if edges:
-            try:
-                width = polyline[0][2]
-                if width and dxfRenderPolylineWidth:
-                    w = Part.Wire(edges)
-                    w1 = w.makeOffset(width/2)
-                    if polyline.is_closed:
-                        w2 = w.makeOffset(-width/2)
-                        w1 = Part.Face(w1)
-                        w2 = Part.Face(w2)
-                        if w1.BoundBox.DiagonalLength > w2.BoundBox.DiagonalLength:
-                            return w1.cut(w2)
-                        else:
-                            return w2.cut(w1)
+        return ezpolylineShape(polyline, edges, verts, curves)
+    return None
+
+def ezpolylineShape(polyline, edges, verts, curves):
+    # Shape of a polyline from its edges, verts are its points as vectors
+    # and curves tells if an open segment has a bulge
+    if edges:
+        try:
+            width = polyline[0][2]
+            if width and dxfRenderPolylineWidth:
+                w = Part.Wire(edges)
+                w1 = w.makeOffset(width/2)
+                if polyline.is_closed:
+                    w2 = w.makeOffset(-width/2)
+                    w1 = Part.Face(w1)
+                    w2 = Part.Face(w2)
+                    if w1.BoundBox.DiagonalLength > w2.BoundBox.DiagonalLength:
+                        return w1.cut(w2)
                     else:
-                        return Part.Face(w1)
-                elif (dxfCreateDraft or dxfCreateSketch) and (not curves):
-                    ob = Draft.makeWire(verts)
-                    ob.Closed = polyline.is_closed
-                    #ob.Placement = placementFromDXFOCS(polyline)
-                    ob.Placement = FreeCAD.Placement()
-                    return ob
+                        return w2.cut(w1)
                 else:
-                    if polyline.is_closed and dxfFillMode:
-                        w = Part.Wire(edges)
-                        #w.Placement = placementFromDXFOCS(polyline)
-                        w.Placement = FreeCAD.Placement()
-                        return Part.Face(w)
-                    else:
-                        w = Part.Wire(edges)
-                        #w.Placement = placementFromDXFOCS(polyline)
-                        w.Placement = FreeCAD.Placement()
-                        return w
-            except Part.OCCError:
-                pass
-                #importDXF.warn(polyline, num)
+                    return Part.Face(w1)
+            elif (dxfCreateDraft or dxfCreateSketch) and (not curves):
+                ob = Draft.makeWire(verts)
+                ob.Closed = polyline.is_closed
+                #ob.Placement = placementFromDXFOCS(polyline)
+                ob.Placement = FreeCAD.Placement()
+                return ob
+            else:
+                if polyline.is_closed and dxfFillMode:
+                    w = Part.Wire(edges)
+                    #w.Placement = placementFromDXFOCS(polyline)
+                    w.Placement = FreeCAD.Placement()
+                    return Part.Face(w)
+                else:
+                    w = Part.Wire(edges)
+                    #w.Placement = placementFromDXFOCS(polyline)
+                    w.Placement = FreeCAD.Placement()
+                    return w
+        except Part.OCCError:
+            pass
+            #importDXF.warn(polyline, num)
     return None
 
+def ezdrawPolylines(polylines):
+    # ezdrawPolyline for many polylines at once. The points are rounded
+    # with one precision lookup, the arc midpoints (calcBulge) and the
+    # isColinear tests of all bulged segments are done in one NumPy step,
+    # and polylines without arcs are built with a single Part.makePolygon.
+    # Returns what ezdrawPolyline returns, per polyline.
+    prec = importDXF.prec()
+    vecs = []
+    bulges = []
+    spans = []
+    for polyline in polylines:
+        z = round(polyline.dxf.elevation, prec)
+        pts = polyline.get_points('xyb')
+        spans.append((len(vecs), len(pts)))
+        for x, y, b in pts:
+            v = FreeCAD.Vector(round(x, prec), round(y, prec), z)
+            if dxfScaling != 1:
+                v.multiply(dxfScaling)
+            vecs.append(v)
+            bulges.append(b)
+
+    # Segments as (start, end) rows of vecs, closing segments included
+    seg1 = []
+    seg2 = []
+    for polyline, (f, n) in zip(polylines, spans):
+        if n > 1:
+            seg1.extend(range(f, f + n - 1))
+            seg2.extend(range(f + 1, f + n))
+            if polyline.is_closed:
+                seg1.append(f + n - 1)
+                seg2.append(f)
+    P = np.array([(v.x, v.y, v.z) for v in vecs], dtype=np.float64).reshape(-1, 3)
+    b = np.array(bulges, dtype=np.float64)[seg1]
+    v1 = P[seg1]
+    v2 = P[seg2]
+
+    # importDXF.calcBulge
+    chord = v2 - v1
+    length = np.sqrt((chord * chord).sum(axis=1))
+    perp = np.stack((chord[:, 1], -chord[:, 0], np.zeros(len(chord))), axis=1)
+    plen = np.sqrt((perp * perp).sum(axis=1))
+    perp[plen > 0] /= plen[plen > 0, None]
+    cv = v1 + chord * 0.5 - perp * (b * length / 2)[:, None]
+
+    # DraftVecUtils.isColinear([v1, cv, v2]), the angle at v1
+    u = cv - v1
+    ulen = np.sqrt((u * u).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dp = (u * chord).sum(axis=1) / ulen / length
+    angle = np.where((ulen == 0) | (length == 0), 0.0, np.arccos(np.clip(dp, -1.0, 1.0)))
+    isArc = (b != 0) & (np.round(angle, prec) != 0)
+    arcs = isArc.tolist()
+    cvs = cv.tolist()
+
+    shapes = []
+    k = 0
+    for polyline, (f, n) in zip(polylines, spans):
+        if n <= 1:
+            shapes.append(None)
+            continue
+        nseg = n if polyline.is_closed else n - 1
+        verts = vecs[f:f+n]
+        curves = any(bulges[f:f+n-1])
+        closing = polyline.is_closed and not DraftVecUtils.equals(vecs[f+n-1], vecs[f])
+        if not any(arcs[k:k+nseg]):
+            try:
+                edges = Part.makePolygon(verts + [vecs[f]] if closing else verts).Edges
+            except Part.OCCError:
+                # degenerate, let the segment by segment path decide
+                shapes.append(ezdrawPolyline(polyline))
+                k += nseg
+                continue
+        else:
+            edges = []
+            for j in range(nseg):
+                if j == n - 1 and not closing:
+                    continue
+                a = verts[j]
+                c = verts[(j + 1) % n]
+                try:
+                    if arcs[k+j]:
+                        edges.append(Part.Arc(a, FreeCAD.Vector(*cvs[k+j]), c).toShape())
+                    else:
+                        edges.append(Part.LineSegment(a, c).toShape())
+                except Part.OCCError:
+                    pass
+        k += nseg
+        shapes.append(ezpolylineShape(polyline, edges, verts, curves))
+    return shapes
+
 def ezdrawLine(line):
     v1 = ezvec(line.dxf.start)
     v2 = ezvec(line.dxf.end)
@@ -815,13 +628,73 @@ def ezdrawCircle(circle):
         #importDXF.warn(circle)
     return None
 
+def ezdrawGeometry(geom):
+    # Part shapes of every row of a LayerGeometry
+    shapes = ezdrawPolylines(geom.query('LWPOLYLINE'))
+    shapes += [ezdrawLine(line) for line in geom.query('LINE')]
+    shapes += [ezdrawArc(arc) for arc in geom.query('ARC')]
+    shapes += [ezdrawCircle(circle) for circle in geom.query('CIRCLE')]
+    return [shape for shape in shapes if shape]
+
+def ezlocateBlocks(mydoc):
+    # Group of the block shapes the links of all layers point to
+    group = mydoc.getObject("PCAPBlocks")
+    if group is None:
+        group = mydoc.addObject("App::DocumentObjectGroup", "PCAPBlocks")
+        group.Label = "Blocks"
+    return group
+
+def ezaddLinks(links, mydoc, layer):
+    # One hidden Part::Feature per block of BlockLinks links, holding the
+    # block shapes in block coordinates, and one App::Link array per block
+    # placing it at every INSERT. The links go into the layer.
+    lay_color = ezlayerColor(layer.color)
+    lay = ezlocateLayer(layer.dxf.name, mydoc, lay_color, "Solid")
+    group = ezlocateBlocks(mydoc)
+    newobs = []
+    linkobs = []
+    for name, (geom, matrices) in links.items():
+        shapes = ezdrawGeometry(geom)
+        if not shapes:
+            continue
+        block = mydoc.addObject("Part::Feature", "Block")
+        block.Label = importDXF.decodeName(name)
+        block.Shape = Part.makeCompound(shapes)
+        block.ViewObject.LineColor = lay_color
+        block.ViewObject.PointColor = lay_color
+        block.ViewObject.Visibility = False
+        group.addObject(block)
+
+        placements = []
+        scales = []
+        for x, y, z, rotation, scale in links.placements(name):
+            placements.append(FreeCAD.Placement(FreeCAD.Vector(x, y, z) * dxfScaling,
+                                                FreeCAD.Rotation(FreeCAD.Vector(0, 0, 1), rotation)))
+            scales.append(FreeCAD.Vector(scale, scale, scale))
+        link = mydoc.addObject("App::Link", "Link")
+        link.Label = block.Label
+        link.setLink(block)
+        # elements stay inside the link instead of one object each
+        link.ShowElement = False
+        link.ElementCount = len(placements)
+        link.PlacementList = placements
+        link.ScaleList = scales
+        newobs.extend([block, link])
+        linkobs.append(link)
+    # For old style layers, which are just groups
+    if hasattr(lay, "addObject"):
+        lay.addObjects(linkobs)
+    # For new Draft Layers
+    elif hasattr(lay, "Proxy") and hasattr(lay.Proxy, "addObject"):
+        lay.Group = lay.Group + linkobs
+    return newobs
+
 def ezlocateLayer(wantedLayer, mydoc, color=None, drawstyle=None):
-    # layers is a global variable.
+    # layers is a global variable, a dict of the FreeCAD layers by label.
     # It should probably be passed as an argument.
     wantedLayerName = importDXF.decodeName(wantedLayer)
-    for l in layers:
-        if wantedLayerName == l.Label:
-            return l
+    if wantedLayerName in layers:
+        return layers[wantedLayerName]
     if dxfUseDraftVisGroups:
         newLayer = Draft.make_layer(name=wantedLayer,
                                    line_color=color,
@@ -829,17 +702,26 @@ def ezlocateLayer(wantedLayer, mydoc, color=None, drawstyle=None):
     else:
         newLayer = mydoc.addObject("App::DocumentObjectGroup", wantedLayer)
     newLayer.Label = wantedLayerName
-    layers.append(newLayer)
+    layers[wantedLayerName] = newLayer
     return newLayer
 
-def ezaddObject(shape, mydoc, name="Shape", layer=None):
+@lru_cache(maxsize=None)
+def ezlayerColor(aci):
+    return tuple( i/255 for i in ezdxf.colors.aci2rgb(aci))
+
+def ezaddObject(shape, mydoc, name="Shape", layer=None, batch=None):
+    # With a batch list, Part shapes are collected for ezaddBatch and None
+    # is returned
+    if batch is not None and isinstance(shape, Part.Shape):
+        batch.append(shape)
+        return None
     if isinstance(shape, Part.Shape):
         newob = mydoc.addObject("Part::Feature", name)
         newob.Shape = shape
     else:
         newob = shape
     if layer:
-        lay_color = tuple( i/255 for i in ezdxf.colors.aci2rgb(layer.color))
+        lay_color = ezlayerColor(layer.color)
         lay = ezlocateLayer(layer.dxf.name, mydoc, lay_color, "Solid")
         # For old style layers, which are just groups
         if hasattr(lay, "addObject"):
@@ -853,6 +735,28 @@ def ezaddObject(shape, mydoc, name="Shape", layer=None):
             newob.ViewObject.PointColor = lay_color
     return newob
 
+def ezaddBatch(shapes, mydoc, layer):
+    # One compound per pcapBatchChunk shapes instead of one feature per
+    # shape, added to the layer and colored in one go
+    chunk = pcapBatchChunk or len(shapes)
+    lay_color = ezlayerColor(layer.color)
+    lay = ezlocateLayer(layer.dxf.name, mydoc, lay_color, "Solid")
+    newobs = []
+    for i in range(0, len(shapes), chunk):
+        newob = mydoc.addObject("Part::Feature", "Compound")
+        newob.Shape = Part.makeCompound(shapes[i:i+chunk])
+        if not dxfUseDraftVisGroups:
+            newob.ViewObject.LineColor = lay_color
+            newob.ViewObject.PointColor = lay_color
+        newobs.append(newob)
+    # For old style layers, which are just groups
+    if hasattr(lay, "addObject"):
+        lay.addObjects(newobs)
+    # For new Draft Layers
+    elif hasattr(lay, "Proxy") and hasattr(lay.Proxy, "addObject"):
+        lay.Group = lay.Group + newobs
+    return newobs
+
 def ezreadPreferences():
     # reading parameters
     p = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Draft")
@@ -887,3 +791,43 @@ def ezreadPreferences():
     #dxfDefaultColor = getColor()
     dxfExportBlocks = p.GetBool("dxfExportBlocks", True)
     dxfScaling = p.GetFloat("dxfScaling", 1.0)
+
+    pp = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/PCAP")
+    global pcapParallelJoin, pcapJoinWorkers
+    pcapParallelJoin = pp.GetBool("pcapParallelJoin", False)
+    pcapJoinWorkers = pp.GetInt("pcapJoinWorkers", 0)
+    global pcapJoinTolerance, pcapLayerCache, pcapLayerCacheMB
+    pcapJoinTolerance = pp.GetFloat("pcapJoinTolerance", 0.0)
+    pcapLayerCache = pp.GetBool("pcapLayerCache", True)
+    pcapLayerCacheMB = pp.GetInt("pcapLayerCacheMB", 512)
+    # "greedy" or "graph", see ezgeom.ezJoinPolys
+    global pcapJoinEngine
+    pcapJoinEngine = pp.GetString("pcapJoinEngine", "greedy")
+    # Snap the endpoints of a layer within pcapJoinTolerance before joining
+    global pcapSnapEndpoints
+    pcapSnapEndpoints = pp.GetBool("pcapSnapEndpoints", False)
+    # Drop repeated LINE, ARC and LWPOLYLINE pieces of a layer before joining
+    global pcapDedupe
+    pcapDedupe = pp.GetBool("pcapDedupe", False)
+    # Merge collinear LINE pieces that overlap or touch before joining
+    global pcapMergeLines
+    pcapMergeLines = pp.GetBool("pcapMergeLines", False)
+    # Chord tolerance in drawing units to simplify the straight runs of
+    # joined polylines within, 0 for none
+    global pcapSimplifyTolerance
+    pcapSimplifyTolerance = pp.GetFloat("pcapSimplifyTolerance", 0.0)
+    # One compound per layer (pcapBatchChunk shapes each, 0 for all)
+    # instead of a feature per shape
+    global pcapBatchObjects, pcapBatchChunk
+    pcapBatchObjects = pp.GetBool("pcapBatchObjects", False)
+    pcapBatchChunk = pp.GetInt("pcapBatchChunk", 0)
+    # Write the stage profile of each run next to the DXF
+    global pcapProfileFile
+    pcapProfileFile = pp.GetBool("pcapProfileFile", True)
+    # Save the joined layers as <drawing>.joined.dxf
+    global pcapExportJoined
+    pcapExportJoined = pp.GetBool("pcapExportJoined", False)
+    # Block references as App::Link arrays of one shape per block instead
+    # of exploded geometry
+    global pcapLinkBlocks
+    pcapLinkBlocks = pp.GetBool("pcapLinkBlocks", False)
@@ -0,0 +1,62 @@
+import os
+import json
+from time import time
+
+# Wall time and entity counts of the stages of one ezprocessdxf run,
+# per layer where a stage works layer by layer. The report goes to the
+# console and to a JSON file next to the DXF.
+
+class StageProfile:
+    def __init__(self, source=None):
+        self.m_source = source
+        self.m_started = time()
+        self.m_records = []
+
+    def add(self, name, layer=None, secs=0.0, count=None):
+        # One record of stage name, layer is None for whole-run stages
+        self.m_records.append({"stage": name, "layer": layer, "secs": secs, "count": count})
+
+    def totals(self):
+        # {stage: {"secs", "count"}} in the order the stages first ran
+        totals = {}
+        for rec in self.m_records:
+            t = totals.setdefault(rec["stage"], {"secs": 0.0, "count": None})
+            t["secs"] += rec["secs"]
+            if rec["count"] is not None:
+                t["count"] = (t["count"] or 0) + rec["count"]
+        return totals
+
+    def elapsed(self):
+        return time() - self.m_started
+
+    def reportText(self):
+        total = self.elapsed()
+        lines = ["Profile of {} : {:.3f} secs".format(self.m_source or "run", total)]
+        for name, t in self.totals().items():
+            count = "" if t["count"] is None else "{:>9} entities".format(t["count"])
+            share = 100.0 * t["secs"] / total if total else 0.0
+            lines.append("  {:<10} {:9.3f} secs {:5.1f}% {}".format(name, t["secs"], share, count))
+            for rec in self.m_records:
+                if rec["stage"] == name and rec["layer"] is not None:
+                    count = "" if rec["count"] is None else "{:>9} entities".format(rec["count"])
+                    lines.append("    {:<22} {:9.3f} secs {}".format(rec["layer"], rec["secs"], count))
+        return "\n".join(lines)
+
+    def toDict(self):
+        return {
+            "source": self.m_source,
+            "started": self.m_started,
+            "secs": self.elapsed(),
+            "stages": self.totals(),
+            "records": self.m_records,
+        }
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.toDict(), f, indent=1, ensure_ascii=False)
+        os.replace(tmp, path)
+
+def ezprofilePath(file_path):
+    # <drawing>.profile.json next to the DXF
+    return os.path.splitext(file_path)[0] + ".profile.json"
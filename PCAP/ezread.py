@@ -0,0 +1,126 @@
+import io
+import ezdxf
+from ezdxf.lldxf.tagger import ascii_tags_loader
+from ezdxf.lldxf.validator import is_binary_dxf_file
+from ezdxf.filemanagement import dxf_file_info
+
+# Layer-filtered DXF loading. The file is streamed twice as raw tags:
+# the first pass collects the blocks referenced from the selected layers,
+# the second copies HEADER, CLASSES, TABLES and OBJECTS unchanged and keeps
+# only the selected modelspace entities and the blocks they need. The
+# filtered text is then loaded by ezdxf, so peak memory follows the
+# selected geometry instead of the file size.
+
+FOLLOWERS = ('VERTEX', 'ATTRIB', 'SEQEND')
+
+def ezreadLayers(file_path, layers):
+    # Returns an ezdxf document holding all tables but only the modelspace
+    # entities on layers, plus the block definitions those entities use.
+    # layers=[] gives a document with the layer table only.
+    if is_binary_dxf_file(file_path):
+        return ezdxf.readfile(file_path)
+
+    layers = set(layers)
+    blocks = _referencedBlocks(file_path, layers)
+    out = io.StringIO()
+    with _open(file_path) as stream:
+        for group in _filterGroups(_groups(ascii_tags_loader(stream)), layers, blocks):
+            for tag in group:
+                out.write("%d\n%s\n" % (tag.code, tag.value))
+    out.seek(0)
+    return ezdxf.read(out)
+
+def ezreadLayerNames(file_path):
+    return [layer.dxf.name for layer in ezreadLayers(file_path, []).layers]
+
+def _open(file_path):
+    return open(file_path, 'rt', encoding=dxf_file_info(file_path).encoding, errors='surrogateescape')
+
+def _groups(tags):
+    # Split the tag stream into structure groups, each starting with code 0
+    group = []
+    for tag in tags:
+        if tag.code == 0 and group:
+            yield group
+            group = []
+        group.append(tag)
+    if group:
+        yield group
+
+def _value(group, code, default=None):
+    for tag in group:
+        if tag.code == code:
+            return tag.value
+    return default
+
+def _inModelspace(group):
+    return _value(group, 67, '0').strip() != '1'
+
+def _referencedBlocks(file_path, layers):
+    # Names of the blocks used by INSERTs on layers, nested blocks included
+    roots = set()
+    nested = {}
+    section = None
+    block = None
+    with _open(file_path) as stream:
+        for group in _groups(ascii_tags_loader(stream)):
+            kind = group[0].value
+            if kind == 'SECTION':
+                section = _value(group, 2)
+            elif kind == 'ENDSEC':
+                section = None
+            elif section == 'BLOCKS':
+                if kind == 'BLOCK':
+                    block = _value(group, 2)
+                elif kind == 'ENDBLK':
+                    block = None
+                elif kind in ('INSERT', 'DIMENSION') and block is not None:
+                    nested.setdefault(block, set()).add(_value(group, 2))
+            elif section == 'ENTITIES':
+                if kind in ('INSERT', 'DIMENSION') and _value(group, 8, '0') in layers and _inModelspace(group):
+                    roots.add(_value(group, 2))
+
+    found = set()
+    todo = list(roots)
+    while todo:
+        name = todo.pop()
+        if name in found:
+            continue
+        found.add(name)
+        todo.extend(nested.get(name, ()))
+    return found
+
+def _filterGroups(groups, layers, blocks):
+    section = None
+    keep = True
+    for group in groups:
+        kind = group[0].value
+        if kind == 'SECTION':
+            section = _value(group, 2)
+            keep = True
+            yield group
+        elif kind == 'ENDSEC':
+            section = None
+            keep = True
+            yield group
+        elif section == 'BLOCKS':
+            if kind == 'BLOCK':
+                name = _value(group, 2, '')
+                # Layout blocks are kept as empty definitions
+                layout = name.upper().startswith(('*MODEL_SPACE', '*PAPER_SPACE'))
+                keep = name in blocks
+                if keep or layout:
+                    yield group
+            elif kind == 'ENDBLK':
+                if keep or layout:
+                    yield group
+                keep = True
+            elif keep:
+                yield group
+        elif section == 'ENTITIES':
+            if kind not in FOLLOWERS:
+                keep = _value(group, 8, '0') in layers and _inModelspace(group)
+            if keep:
+                yield group
+        else:
+            yield group
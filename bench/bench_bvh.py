@@ -0,0 +1,35 @@
+# Build-time benchmark of the join spatial indexes (BVHAccel, EndpointGrid).
+# Runs in plain Python, only ezdxf and numpy are needed:
+#   python bench/bench_bvh.py [n_entities ...]
+import os
+import sys
+from time import time
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(__dir__, "..", "PCAP"))
+from ezgeom import BVHAccel, EndpointGrid
+from synth import syntheticGeometry, tryGeometry
+
+def benchQueries(index, ents):
+    start = time()
+    for ent in ents:
+        index.findNextEntity([ent])
+        ent.reverse = False
+    return time() - start
+
+def run(name, ents):
+    print("{}: {} entities".format(name, len(ents)))
+    for method in (BVHAccel.splitMethod.NAIVE, BVHAccel.splitMethod.SAH):
+        bvh = BVHAccel(ents, method)
+        print("  BVH {:5s} build {:8.3f} secs, {} nodes, queries {:8.3f} secs".format(
+            method.name, bvh.m_buildTime, len(bvh.m_offsets), benchQueries(bvh, ents)))
+    start = time()
+    grid = EndpointGrid(ents)
+    print("  Grid       build {:8.3f} secs, {} endpoints, queries {:8.3f} secs".format(
+        time() - start, len(grid.m_points), benchQueries(grid, ents)))
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    run("try.dxf", tryGeometry().entities())
+    for n in sizes:
+        run("synthetic", syntheticGeometry(n)[0].entities())
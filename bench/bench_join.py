@@ -0,0 +1,115 @@
+# Join and import benchmark, runs without FreeCAD:
+#   python bench/bench_join.py [n_entities ...] [--engine greedy|graph]
+#       [--tol 1e-3] [--snap] [--dup 0.01] [--gap 0.02] [--dedupe] [--merge]
+#       [--simplify 1e-3] [--import]
+# Layers are try.dxf and synthetic layers from synth.py. Each join reports
+# entities/second, the tracemalloc peak of a second run and the chain
+# count; on a synthetic layer without duplicates every shape should come
+# back as one closed chain. --import writes the layer to a DXF and times
+# the FreeCAD-free part of ezprocessdxf stage by stage. checkArcJunction
+# runs first and stops the benchmark if the graph engine pairs an arc
+# with the wrong edge at a branch vertex.
+import os
+import sys
+import argparse
+import tempfile
+import tracemalloc
+from time import time
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(__dir__, "..", "PCAP"))
+from ezgeom import LayerGeometry, ezJoinGeometry, ezdedupeGeometry, ezmergeLines, ezsimplifyPolylines
+from ezjoindxf import ezjoinLayers
+import ezread
+import ezprofile
+from synth import syntheticGeometry, writeDxf, tryGeometry
+
+def closedCount(geom):
+    kinds = geom.m_kind
+    poly = kinds == LayerGeometry.KINDS.index('LWPOLYLINE')
+    return int((geom.m_params[poly, 1] != 0).sum()) + int((kinds == LayerGeometry.KINDS.index('CIRCLE')).sum())
+
+def checkArcJunction():
+    # A counterclockwise quarter arc meeting three LINEs at (1,0): the graph
+    # engine has to go on along the tangent LINE to (1,-1), not turn into
+    # the perpendicular one to (2,0)
+    raws = [('ARC', (0, 0, 0), 1.0, 0.0, 90.0, (0, 0, 1)), ('LINE', (1, 0, 0), (1, -1, 0)),
+            ('LINE', (1, 0, 0), (0, -1, 0)), ('LINE', (1, 0, 0), (2, 0, 0))]
+    joined = ezJoinGeometry(LayerGeometry.fromRaws(raws), None, "grid", "graph")
+    chains = [sorted((round(v[0], 9), round(v[1], 9)) for v in joined.points(i)) for i in range(len(joined))]
+    assert [(0.0, 1.0), (1.0, -1.0), (1.0, 0.0)] in chains, "Arc not joined to its tangent LINE"
+
+def benchJoin(geom, engine, tol, snap, memory=True):
+    start = time()
+    joined = ezJoinGeometry(geom, tol, "grid", engine, snap)
+    secs = time() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        ezJoinGeometry(geom, tol, "grid", engine, snap)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return joined, secs, peak
+
+def report(name, geom, shapes, args):
+    print("{}: {} entities{}".format(name, len(geom), "" if shapes is None else ", {} shapes".format(shapes)))
+    if args.dedupe:
+        start = time()
+        geom, removed = ezdedupeGeometry(geom)
+        secs = time() - start
+        print("  dedupe {:9.3f} secs {:>12.0f} ent/s {:>10} removed".format(secs, (len(geom) + removed) / secs if secs else 0.0, removed))
+    if args.merge:
+        start = time()
+        geom, removed = ezmergeLines(geom)
+        secs = time() - start
+        print("  merge  {:9.3f} secs {:>12.0f} ent/s {:>10} removed".format(secs, (len(geom) + removed) / secs if secs else 0.0, removed))
+    for engine in args.engine:
+        joined, secs, peak = benchJoin(geom, engine, args.tol, args.snap, not args.no_memory)
+        print("  {:6s} {:9.3f} secs {:>12.0f} ent/s {:>10} chains {:>10} closed{}".format(
+            engine, secs, len(geom) / secs if secs else 0.0, len(joined), closedCount(joined),
+            "" if peak is None else " {:9.1f} MB peak".format(peak / 2**20)))
+        if args.simplify:
+            start = time()
+            simple, removed = ezsimplifyPolylines(joined, args.simplify)
+            secs = time() - start
+            print("  simplify {:7.3f} secs {:>12.0f} ent/s {:>10} vertexes {:>10} removed".format(
+                secs, len(joined) / secs if secs else 0.0, len(joined.m_verts), removed))
+
+def benchImport(geom, args, layer="SYN"):
+    # read, bucket, collect and join as ezprocessdxf does
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, "bench.dxf")
+        writeDxf(file_path, {layer: geom})
+        for engine in args.engine:
+            profile = ezprofile.StageProfile("{} entities, {} engine".format(len(geom), engine))
+            start = time()
+            doc = ezread.ezreadLayers(file_path, [layer])
+            profile.add("read", None, time() - start, len(doc.modelspace()))
+            ezjoinLayers(doc, [layer], args.tol, engine, args.snap, args.dedupe, profile=profile, log=lambda text: None,
+                         merge=args.merge, simplify=args.simplify)
+            print(profile.reportText())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", nargs="*", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--engine", action="append", choices=["greedy", "graph"])
+    parser.add_argument("--tol", type=float, default=None)
+    parser.add_argument("--snap", action="store_true")
+    parser.add_argument("--dup", type=float, default=0.0)
+    parser.add_argument("--gap", type=float, default=0.0)
+    parser.add_argument("--dedupe", action="store_true")
+    parser.add_argument("--merge", action="store_true")
+    parser.add_argument("--simplify", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--import", dest="imports", action="store_true")
+    parser.add_argument("--no-memory", action="store_true")
+    args = parser.parse_args()
+    args.engine = args.engine or ["greedy", "graph"]
+
+    checkArcJunction()
+    report("try.dxf", tryGeometry(), None, args)
+    for n in args.sizes:
+        geom, shapes = syntheticGeometry(n, args.seed, dup=args.dup, gap=args.gap)
+        report("synthetic", geom, shapes, args)
+        if args.imports:
+            benchImport(geom, args)
@@ -0,0 +1,126 @@
+# Synthetic join layers for the benchmarks. A layer is made of shapes that
+# each join back to one closed outline:
+#   rectangle  edges split into 1-3 LINE or open LWPOLYLINE pieces, round
+#              corners as ARCs
+#   slot       two LINEs and two half circle ARCs
+# Pieces are shuffled, reversed at random, duplicated (dup) and moved off
+# their neighbour by gapSize (gap) to give near-miss endpoints.
+#   python bench/synth.py out.dxf [n_entities] [layer]
+import os
+import sys
+import math
+import random
+
+import ezdxf
+
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(__dir__, "..", "PCAP"))
+from ezgeom import LayerGeometry, ezunpackEntity
+
+TRY_DXF = os.path.join(__dir__, "..", "trytry", "try.dxf")
+
+def _piece(a, b, poly):
+    if poly:
+        return ('LWPOLYLINE', [(a[0], a[1], 0.0, 0.0, 0.0), (b[0], b[1], 0.0, 0.0, 0.0)], 0.0, False, 0.0)
+    return ('LINE', (a[0], a[1], 0.0), (b[0], b[1], 0.0))
+
+def _arc(cx, cy, r, start, end):
+    return ('ARC', (cx, cy, 0.0), r, start, end, (0.0, 0.0, 1.0))
+
+def _split(a, b, parts):
+    return [((a[0] + (b[0]-a[0]) * k / parts, a[1] + (b[1]-a[1]) * k / parts),
+             (a[0] + (b[0]-a[0]) * (k+1) / parts, a[1] + (b[1]-a[1]) * (k+1) / parts)) for k in range(parts)]
+
+def rectangle(x, y, rnd):
+    w, h, r = rnd.uniform(4.0, 8.0), rnd.uniform(2.0, 6.0), 0.5
+    edges = [((x+r, y), (x+w-r, y)), ((x+w, y+r), (x+w, y+h-r)),
+             ((x+w-r, y+h), (x+r, y+h)), ((x, y+h-r), (x, y+r))]
+    raws = []
+    for a, b in edges:
+        for p, q in _split(a, b, rnd.randint(1, 3)):
+            raws.append(_piece(p, q, rnd.random() < 0.3))
+    for (cx, cy), sa in (((x+w-r, y+r), 270), ((x+w-r, y+h-r), 0), ((x+r, y+h-r), 90), ((x+r, y+r), 180)):
+        raws.append(_arc(cx, cy, r, sa, (sa + 90) % 360))
+    return raws
+
+def slot(x, y, rnd):
+    length, r = rnd.uniform(3.0, 7.0), rnd.uniform(0.5, 1.5)
+    y += r
+    return [_piece((x+r, y-r), (x+r+length, y-r), False),
+            _arc(x+r+length, y, r, 270, 90),
+            _piece((x+r+length, y+r), (x+r, y+r), False),
+            _arc(x+r, y, r, 90, 270)]
+
+def _reverse(raw):
+    if raw[0] == 'LINE':
+        return ('LINE', raw[2], raw[1])
+    if raw[0] == 'LWPOLYLINE':
+        return raw[:1] + (raw[1][::-1],) + raw[2:]
+    return raw
+
+def _nudge(raw, d, rnd):
+    # Move the first endpoint of a straight piece by d in a random direction
+    t = rnd.uniform(0.0, 2 * math.pi)
+    dx, dy = d * math.cos(t), d * math.sin(t)
+    if raw[0] == 'LINE':
+        return ('LINE', (raw[1][0] + dx, raw[1][1] + dy, 0.0), raw[2])
+    if raw[0] == 'LWPOLYLINE':
+        first = raw[1][0]
+        return raw[:1] + ([(first[0] + dx, first[1] + dy) + tuple(first[2:])] + raw[1][1:],) + raw[2:]
+    return raw
+
+def syntheticRaws(n, seed=0, dup=0.0, gap=0.0, gapSize=1e-4, slots=0.3):
+    # At least n raw entity tuples, whole shapes only, and the number of
+    # shapes they came from
+    rnd = random.Random(seed)
+    side = int(math.sqrt(n / 8)) + 1
+    raws = []
+    shapes = 0
+    while len(raws) < n:
+        x, y = (shapes % side) * 12.0, (shapes // side) * 10.0
+        for raw in (slot if rnd.random() < slots else rectangle)(x, y, rnd):
+            if rnd.random() < 0.5:
+                raw = _reverse(raw)
+            if rnd.random() < gap:
+                raw = _nudge(raw, gapSize, rnd)
+            raws.append(raw)
+            if rnd.random() < dup:
+                raws.append(raw)
+        shapes += 1
+    rnd.shuffle(raws)
+    return raws, shapes
+
+def syntheticGeometry(n, seed=0, **kw):
+    raws, shapes = syntheticRaws(n, seed, **kw)
+    return LayerGeometry.fromRaws(raws), shapes
+
+def writeDxf(file_path, layers):
+    # layers is {name: LayerGeometry}
+    doc = ezdxf.new()
+    msp = doc.modelspace()
+    for l, geom in layers.items():
+        doc.layers.add(name=l)
+        for raw in geom.raws():
+            ezunpackEntity(raw, msp, {"layer": l})
+    doc.saveas(file_path)
+
+def tryGeometry(file_path=TRY_DXF):
+    # Every exploded block entity of try.dxf, SOLIDs as open lwpolylines
+    doc = ezdxf.readfile(file_path)
+    msp = doc.modelspace()
+    ents = []
+    for e in list(msp):
+        for be in (e.virtual_entities() if e.dxftype() == 'INSERT' else [e]):
+            if be.dxftype() == 'SOLID':
+                be = msp.add_lwpolyline(be.vertices())
+            if be.dxftype() in ('LINE', 'ARC', 'LWPOLYLINE'):
+                ents.append(be)
+    return LayerGeometry.fromEntities(ents)
+
+if __name__ == "__main__":
+    out = sys.argv[1]
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    layer = sys.argv[3] if len(sys.argv) > 3 else "SYN"
+    geom, shapes = syntheticGeometry(n, dup=0.01, gap=0.02)
+    writeDxf(out, {layer: geom})
+    print("{}: {} entities from {} shapes on layer {}".format(out, len(geom), shapes, layer))